@@ -39,10 +39,13 @@ class NiCrWorkbench(Workbench):
         import NiCrInit
         self.tools = ['CreateNiCrMachine',
                       'CreateToolPath',
+                      'BatchRoute',
                       'CreatePathLink',
+                      'AutoRoute',
                       'SaveWirePath',
                       'ImportWirePath',
-                      'RunPathSimulation']
+                      'RunPathSimulation',
+                      'EstimateCutTime']
 
         FreeCAD.t = self.appendToolbar('NiCrWorkbench', self.tools)
         self.appendMenu('NiCrWorkbench', self.tools)
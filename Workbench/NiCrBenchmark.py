@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# NiCr (Hot Wire CNC Cutter) workbench for FreeCAD
+# (c) 2016 Javier Martínez García
+#***************************************************************************
+#*   (c) Javier Martínez García 2016                                       *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License (GPL)            *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Lesser General Public License for more details.                   *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with FreeCAD; if not, write to the Free Software        *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************/
+
+# Timing helpers for the path generation pipeline. Run them from the FreeCAD
+# python console:
+#   import NiCrBenchmark
+#   NiCrBenchmark.benchmarkRouteGeneration()
+# The benchmarks that only use NiCrCore also run from a plain python shell
+# (FreeCAD is imported only where a shape is needed)
+
+import math
+import os
+import tempfile
+import time
+import numpy
+import NiCrCore
+
+__dir__ = os.path.dirname(__file__)
+
+
+def report(msg):
+    try:
+        import FreeCAD
+        FreeCAD.Console.PrintMessage(msg)
+
+    except ImportError:
+        print(msg.rstrip('\n'))
+
+
+class _ShapeHolder:
+    # minimal stand-in for a document object (ShapeToNiCrPath only needs .Shape)
+    def __init__(self, shape):
+        self.Shape = shape
+
+
+def extrudedPolygon(n_sides, radius=100.0, height=600.0):
+    # prism with n_sides transversal faces, placed along the machine Z axis
+    import FreeCAD
+    import Part
+    points = []
+    for i in range(n_sides):
+        a = 2*math.pi*i/n_sides
+        points.append(FreeCAD.Vector(radius*math.cos(a), radius*math.sin(a), 0))
+
+    points.append(points[0])
+    face = Part.Face(Part.makePolygon(points))
+    return face.extrude(FreeCAD.Vector(0, 0, height))
+
+
+def benchmarkRouteGeneration(face_counts=(16, 64, 256, 1024, 4096), precision=6.0):
+    # prints ShapeToNiCrPath time vs number of transversal faces
+    import NiCrPath
+    results = []
+    report('faces    points    time (s)\n')
+    for n in face_counts:
+        holder = _ShapeHolder(extrudedPolygon(n))
+        t0 = time.time()
+        wirepath = NiCrPath.ShapeToNiCrPath(holder, precision)
+        dt = time.time() - t0
+        results.append((n, len(wirepath[0]), dt))
+        report('%5d  %8d  %10.4f\n' % results[-1])
+
+    return results
+
+
+def _writeNiCrProgramPerPoint(nicr_file, route, zero_point):
+    # reference: MOVE writer of exporter 0.2 (one round/str/write per point)
+    for i in range(len(route[0])):
+        AX = str(round(route[0][i][0] - zero_point[0], 3)) + ' '
+        AY = str(round(route[0][i][1] - zero_point[1], 3)) + ' '
+        BX = str(round(route[1][i][0] - zero_point[0], 3)) + ' '
+        BY = str(round(route[1][i][1] - zero_point[1], 3)) + '\n'
+        nicr_file.write('MOVE ' + AX + AY + BX + BY)
+
+
+def loadExamplePath(repeat=1):
+    # WingAndGear.nicr points, tiled repeat times
+    nicr_file = open(__dir__ + '/WingAndGear.nicr', 'r')
+    path = NiCrCore.readNiCrProgram(nicr_file)
+    nicr_file.close()
+    return NiCrCore.WirePath(numpy.tile(path.A, (repeat, 1)),
+                             numpy.tile(path.B, (repeat, 1)))
+
+
+def benchmarkNiCrWriter(repeats=(1, 100)):
+    # MOVE lines/s of the per point writer vs NiCrCore.writeNiCrProgram
+    results = []
+    report('moves       per point (lines/s)   vectorized (lines/s)\n')
+    for repeat in repeats:
+        route = loadExamplePath(repeat).toRoute()
+        n = len(route[0])
+        fd, file_name = tempfile.mkstemp(suffix='.nicr')
+        os.close(fd)
+        try:
+            nicr_file = open(file_name, 'w')
+            t0 = time.time()
+            _writeNiCrProgramPerPoint(nicr_file, route, (0, 0, 0))
+            nicr_file.close()
+            t_point = time.time() - t0
+            nicr_file = open(file_name, 'w')
+            t0 = time.time()
+            NiCrCore.writeNiCrProgram(nicr_file, route, (0, 0, 0), 'benchmark',
+                                      1200.0, 10.0, 10.0)
+            nicr_file.close()
+            t_vector = time.time() - t0
+
+        finally:
+            os.remove(file_name)
+
+        results.append((n, n / t_point, n / t_vector))
+        report('%8d  %20.0f  %21.0f\n' % results[-1])
+
+    return results
+
+
+def benchmarkPathToShape(repeats=(1, 4, 16)):
+    # PathToShape time of every path representation on the WingAndGear path
+    import NiCrPath
+    results = []
+    report('points  ' + '  '.join('%14s' % r for r in NiCrPath.PATH_REPRESENTATIONS) + '\n')
+    for repeat in repeats:
+        route = loadExamplePath(repeat).toRoute()
+        times = []
+        for representation in NiCrPath.PATH_REPRESENTATIONS:
+            t0 = time.time()
+            NiCrPath.PathToShape(route, representation)
+            times.append(time.time() - t0)
+
+        results.append((len(route[0]), times))
+        report('%6d  ' % len(route[0]) + '  '.join('%13.3fs' % t for t in times) + '\n')
+
+    return results
+
+
+def benchmarkProjection(repeats=(1, 100), planes=(0.0, 794.0)):
+    # points/s of the per point wire projection (runSimulation loop) vs
+    # NiCrCore.projectRouteToPlanes, on WingAndGear with side B at z=1200
+    # (tapered: side B is a scaled copy of side A). Also checks that every
+    # projected point is on its plane and on the wire line
+    results = []
+    report('points      per point (points/s)   vectorized (points/s)   max diff   '
+           'max plane error\n')
+    for repeat in repeats:
+        path = loadExamplePath(repeat)
+        path.B[:, :2] = 0.5*path.A[:, :2] + 20.0
+        path.B[:, 2] = 1200.0
+        side_A = path.A.tolist()
+        side_B = path.B.tolist()
+        Z0, Z1 = planes
+        t0 = time.time()
+        projected = [NiCrCore.projectToPlanes(side_A[i], side_B[i], Z0, Z1)
+                     for i in range(len(side_A))]
+        t_point = time.time() - t0
+        t0 = time.time()
+        projected_A, projected_B = NiCrCore.projectRouteToPlanes(side_A, side_B, Z0, Z1)
+        t_vector = time.time() - t0
+        diff = max(numpy.abs(projected_A - [p[0] for p in projected]).max(),
+                   numpy.abs(projected_B - [p[1] for p in projected]).max())
+        # distance of the projected points to the wire lines and to the planes
+        d = path.B - path.A
+        d /= numpy.sqrt((d*d).sum(axis=1))[:, None]
+        off_line = max(numpy.abs(numpy.cross(projected_A - path.A, d)).max(),
+                       numpy.abs(numpy.cross(projected_B - path.A, d)).max())
+        plane_error = max(numpy.abs(projected_A[:, 2] - Z0).max(),
+                          numpy.abs(projected_B[:, 2] - Z1).max(), off_line)
+        n = len(side_A)
+        results.append((n, n / t_point, n / t_vector, diff, plane_error))
+        report('%8d  %22.0f  %22.0f  %9.2e  %15.2e\n' % results[-1])
+
+    return results
+
+
+def ringPaths(n_parts, spread=3000.0, seed=0):
+    # n_parts circular paths (50 to 2000 points) scattered over a square
+    rng = numpy.random.RandomState(seed)
+    paths = []
+    for k in range(n_parts):
+        n = rng.randint(50, 2000)
+        t = numpy.linspace(0, 2*math.pi, n)
+        r = rng.uniform(10, 50)
+        cx, cy = rng.uniform(0, spread, 2)
+        A = numpy.column_stack((cx + r*numpy.cos(t), cy + r*numpy.sin(t), numpy.zeros(n)))
+        B = A.copy()
+        B[:, 2] = 600.0
+        paths.append((A, B))
+
+    return paths
+
+
+def benchmarkAutoRoute(part_counts=(50, 200, 500, 1000)):
+    # NiCrCore.routeLinks time and link travel vs visiting the parts in order
+    results = []
+    report('parts    time (s)   link travel (mm)   in order (mm)\n')
+    for n in part_counts:
+        paths = ringPaths(n)
+        t0 = time.time()
+        links = NiCrCore.routeLinks(paths)
+        dt = time.time() - t0
+        results.append((n, dt, 2*sum(link[4] for link in links),
+                        2*NiCrCore.chainLength(paths)))
+        report('%5d  %10.3f  %17.1f  %14.1f\n' % results[-1])
+
+    return results
+
+
+def benchmarkSender(windows=(1, 2, 4), time_scale=0.0):
+    # NiCrSender streaming WingAndGear.nicr to NiCrEmulator: NiCrFW.ino as it
+    # is (stop and wait) and a line buffered firmware with every window
+    import NiCrEmulator
+    import NiCrSender
+    commands = NiCrSender.programCommands(__dir__ + '/WingAndGear.nicr')
+    configurations = [('NiCrFW.ino', 1, False)]
+    configurations += [('line buffered', window, True) for window in windows]
+    results = []
+    report('firmware        window   time (s)   commands/s   machine time (s)   lost\n')
+    for name, window, line_buffered in configurations:
+        emulator = NiCrEmulator.FirmwareEmulator(time_scale=time_scale,
+                                                 line_buffered=line_buffered)
+        port = NiCrSender.PosixPort(emulator.port_name)
+        try:
+            sender = NiCrSender.NiCrSender(port, window,
+                                           eol='\n' if line_buffered else '')
+            stats = sender.send(commands)
+
+        finally:
+            port.close()
+            emulator.close()
+
+        data = emulator.summary()
+        results.append((name, window, stats.elapsed, stats.rate(),
+                        data['machine_time'], data['lost'] + data['overruns']))
+        report('%-14s  %6d  %9.3f  %11.0f  %17.1f  %5d\n' % results[-1])
+
+    return results
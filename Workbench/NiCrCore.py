@@ -0,0 +1,1341 @@
+# -*- coding: utf-8 -*-
+# NiCr (Hot Wire CNC Cutter) workbench for FreeCAD
+# (c) 2016 Javier Martínez García
+#***************************************************************************
+#*   (c) Javier Martínez García 2016                                       *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License (GPL)            *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Lesser General Public License for more details.                   *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with FreeCAD; if not, write to the Free Software        *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************/
+
+
+import array
+import collections
+import json
+import mmap
+import os
+import struct
+import time
+import numpy
+
+# Path math that does not depend on FreeCAD, so it can run headless (batch
+# jobs, benchmarks). A wire path is stored as two (N,3) float arrays with the
+# points of machine side A (lower Z) and side B, plus a (M,3) command array
+# with rows [point_index, CutSpeed, WireTemperature].
+# Inside the workbench routes travel as plain tuples (side_A, side_B, commands)
+# of lists, which can be saved in the document (JSON). WirePath converts
+# between both representations.
+
+
+class WirePath:
+    def __init__(self, side_A, side_B, commands=None):
+        self.A = numpy.asarray(side_A, dtype=float).reshape(-1, 3)
+        self.B = numpy.asarray(side_B, dtype=float).reshape(-1, 3)
+        if commands is None:
+            commands = []
+
+        self.commands = numpy.asarray(commands, dtype=float).reshape(-1, 3)
+
+    @classmethod
+    def fromRoute(cls, route):
+        # route -> (side_A, side_B) or (side_A, side_B, commands)
+        if len(route) > 2:
+            return cls(route[0], route[1], route[2])
+
+        return cls(route[0], route[1])
+
+    def toRoute(self):
+        # JSON friendly (side_A, side_B, commands) tuple of lists
+        side_A = [tuple(p) for p in self.A.tolist()]
+        side_B = [tuple(p) for p in self.B.tolist()]
+        commands = [[int(c[0]), c[1], c[2]] for c in self.commands.tolist()]
+        return (side_A, side_B, commands)
+
+    def __len__(self):
+        return len(self.A)
+
+
+def cleanTrajectory(trajectory, tolerance=0.001):
+    # Post-processing of ShapeToNiCrPath. trajectory is a list (one item per
+    # face) of [TA, TB] point sequences. Drops every point of a face whose side
+    # A is closer than tolerance to the next one (the last point of each face is
+    # the first of the next), closes the path and makes side A the lower Z one.
+    parts_A = []
+    parts_B = []
+    for TA, TB in trajectory:
+        TA = numpy.asarray(TA, dtype=float).reshape(-1, 3)
+        TB = numpy.asarray(TB, dtype=float).reshape(-1, 3)
+        step = numpy.sqrt(((TA[1:] - TA[:-1])**2).sum(axis=1))
+        keep = step > tolerance
+        parts_A.append(TA[:-1][keep])
+        parts_B.append(TB[:-1][keep])
+
+    A = numpy.concatenate(parts_A)
+    B = numpy.concatenate(parts_B)
+    A = numpy.vstack((A, A[:1]))
+    B = numpy.vstack((B, B[:1]))
+    if A[0, 2] > B[0, 2]:
+        A, B = B, A
+
+    return WirePath(A, B)
+
+
+# Shape faces as plain data, so routes can be computed without FreeCAD (or in
+# worker processes). Every transversal face of a shape is a dict with:
+#   'edges'     center of mass of each edge (x, y, z), used for adjacency
+#   'vertexes'  vertex points (x, y, z)
+#   'A', 'B'    discretized boundary edges on both machine sides, paired and
+#               running in the same direction
+def quantizePoint(point, tolerance):
+    # returns the grid cell (hashable tuple) that contains point
+    return (int(round(point[0] / tolerance)),
+            int(round(point[1] / tolerance)),
+            int(round(point[2] / tolerance)))
+
+
+def _distance(p, q):
+    return ((p[0]-q[0])**2 + (p[1]-q[1])**2 + (p[2]-q[2])**2)**0.5
+
+
+def faceAdjacency(face_edges, tolerance=0.001):
+    # Builds the face adjacency index of a shape in one pass. Two faces are
+    # neighbours when they share an edge (edges whose center of mass lie closer
+    # than tolerance). Edges are hashed by their quantized center of mass, so
+    # only the 27 cells around each edge have to be checked.
+    # face_edges[face_index] -> edge centers of the face
+    # Returns adjacency[face_index] -> sorted list of neighbour face indexes
+    edge_grid = {}
+    for i in range(len(face_edges)):
+        for cm in face_edges[i]:
+            edge_grid.setdefault(quantizePoint(cm, tolerance), []).append((i, cm))
+
+    adjacency = []
+    for i in range(len(face_edges)):
+        neighbours = set()
+        for cm in face_edges[i]:
+            kx, ky, kz = quantizePoint(cm, tolerance)
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for dz in (-1, 0, 1):
+                        for j, cm_j in edge_grid.get((kx+dx, ky+dy, kz+dz), ()):
+                            if j != i and _distance(cm, cm_j) < tolerance:
+                                neighbours.add(j)
+
+        adjacency.append(sorted(neighbours))
+
+    return adjacency
+
+
+def orderFaces(adjacency, first=0):
+    # Walks the face adjacency index starting at face first and returns the
+    # face indexes ordered so each one shares an edge with the next. At every
+    # step the first not-yet-visited neighbour (in face order) is taken.
+    visited = [False]*len(adjacency)
+    visited[first] = True
+    order = [first]
+    current = first
+    while True:
+        for j in adjacency[current]:
+            if not(visited[j]):
+                break
+
+        else:
+            break
+
+        visited[j] = True
+        order.append(j)
+        current = j
+
+    return order
+
+
+def routeFromFaces(faces, reverse=False, tolerance=0.001):
+    # wire path of a shape from its transversal faces (see above): the faces
+    # are walked in consecutive order and each one is traversed towards the
+    # vertexes it shares with the next face (the last face joins the first)
+    first = 0
+    if reverse:
+        # the walk starts at the same face, the reverse flag only changes the
+        # preference order between its neighbours
+        faces = faces[::-1]
+        first = len(faces) - 1
+
+    order = orderFaces(faceAdjacency([f['edges'] for f in faces], tolerance), first)
+    trajectory = []
+    for k in range(len(order)):
+        face = faces[order[k]]
+        next_face = faces[order[(k + 1) % len(order)]]
+        TA = face['A']
+        TB = face['B']
+        if not any(_distance(TA[-1], v) < 0.01 for v in next_face['vertexes']):
+            TA = TA[::-1]
+            TB = TB[::-1]
+
+        trajectory.append([TA, TB])
+
+    return cleanTrajectory(trajectory)
+
+
+class LRUCache:
+    # bounded mapping that drops the least recently used entry when full,
+    # counting the lookups that found (hits) or missed their key
+    def __init__(self, size=32):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            value = self.entries.pop(key)
+
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def removeDuplicatePoints(route):
+    # Removes every point of side A that is equal to the next one (the route
+    # is closed, so the last point is compared with the first) together with
+    # its side B pair, and remaps the command indexes to the compacted route.
+    # The number of points removed before each old index is computed once and
+    # all commands are shifted with it.
+    path = WirePath.fromRoute(route)
+    n = len(path)
+    if n == 0:
+        return path.toRoute()
+
+    A = path.A
+    removed = (A == numpy.roll(A, -1, axis=0)).all(axis=1)
+    keep = ~removed
+    # removed_before[k] -> number of points removed with index < k
+    removed_before = numpy.concatenate(([0], numpy.cumsum(removed)))
+    commands = path.commands.copy()
+    if len(commands):
+        # a command placed at index k follows the removal of points j < k
+        k = numpy.clip(commands[:, 0], 0, n).astype(int)
+        commands[:, 0] -= removed_before[k]
+
+    return WirePath(A[keep], path.B[keep], commands).toRoute()
+
+
+def segmentDistances(P, a, b):
+    # distances of the (K,3) points P to the segments a-b ((K,3) or (3,))
+    ab = b - a
+    ab2 = (ab**2).sum(axis=-1)
+    t = ((P - a)*ab).sum(axis=-1) / numpy.where(ab2 == 0, 1.0, ab2)
+    t = numpy.clip(t, 0.0, 1.0)
+    return numpy.sqrt(((P - a - t[..., None]*ab)**2).sum(axis=-1))
+
+
+def pairedSamples(curve_A, curve_B, tolerance, initial=8, max_depth=16):
+    # Adaptive sampling of two curves that share their parameter s (0..1):
+    # an interval is split at its middle while the middle point of side A or
+    # side B deviates more than tolerance from the chord, so both sides get the
+    # same s values and their points stay paired. curve_A, curve_B -> functions
+    # s -> (x, y, z). Returns the (K,3) arrays of side A and side B points
+    s = numpy.linspace(0.0, 1.0, initial + 1)
+    A = numpy.array([curve_A(si) for si in s], dtype=float)
+    B = numpy.array([curve_B(si) for si in s], dtype=float)
+    intervals = numpy.arange(initial)
+    for depth in range(max_depth):
+        if len(intervals) == 0:
+            break
+
+        s_mid = 0.5*(s[intervals] + s[intervals + 1])
+        A_mid = numpy.array([curve_A(si) for si in s_mid], dtype=float).reshape(-1, 3)
+        B_mid = numpy.array([curve_B(si) for si in s_mid], dtype=float).reshape(-1, 3)
+        error = numpy.maximum(
+            segmentDistances(A_mid, A[intervals], A[intervals + 1]),
+            segmentDistances(B_mid, B[intervals], B[intervals + 1]))
+        split = error > tolerance
+        if not split.any():
+            break
+
+        # insert the middle points of the split intervals after their start
+        position = intervals[split] + 1
+        s = numpy.insert(s, position, s_mid[split])
+        A = numpy.insert(A, position, A_mid[split], axis=0)
+        B = numpy.insert(B, position, B_mid[split], axis=0)
+        # both halves of every split interval are checked in the next level
+        first = position + numpy.arange(numpy.count_nonzero(split)) - 1
+        intervals = numpy.sort(numpy.concatenate((first, first + 1)))
+
+    return A, B
+
+
+def simplifyMask(A, B, tolerance, keep=None, span=1024):
+    # Douglas-Peucker applied to both sides at once: a point is dropped only
+    # if side A and side B are both within tolerance of the simplified
+    # polylines, so the A/B points stay paired. Points flagged in keep (and
+    # the first and last ones) are never dropped and split the simplification.
+    # Every span-th point is kept too, which bounds the subdivision depth on
+    # long routes, and all the open segments of a subdivision level are
+    # processed in one vectorized step.
+    # Returns (mask of kept points, max deviation of the dropped points)
+    A = numpy.asarray(A, dtype=float)
+    B = numpy.asarray(B, dtype=float)
+    n = len(A)
+    mask = numpy.zeros(n, dtype=bool)
+    if keep is not None:
+        mask[keep] = True
+
+    if n < 3:
+        mask[:] = True
+        return mask, 0.0
+
+    mask[::span] = True
+    mask[-1] = True
+    fixed = numpy.nonzero(mask)[0]
+    starts = fixed[:-1]
+    ends = fixed[1:]
+    max_deviation = 0.0
+    while True:
+        open_segments = ends - starts > 1
+        starts = starts[open_segments]
+        ends = ends[open_segments]
+        if not len(starts):
+            break
+
+        # interior points of every segment, flattened
+        counts = ends - starts - 1
+        offsets = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+        segment = numpy.repeat(numpy.arange(len(starts)), counts)
+        index = starts[segment] + 1 + numpy.arange(counts.sum()) - offsets[segment]
+        d = numpy.maximum(
+            segmentDistances(A[index], A[starts[segment]], A[ends[segment]]),
+            segmentDistances(B[index], B[starts[segment]], B[ends[segment]]))
+        peak = numpy.maximum.reduceat(d, offsets)
+        # first point of each segment where the peak is reached
+        at_peak = numpy.nonzero(d == peak[segment])[0]
+        first = at_peak[numpy.concatenate(([True], segment[at_peak][1:] !=
+                                           segment[at_peak][:-1]))]
+        split = peak > tolerance
+        if not(split.all()):
+            max_deviation = max(max_deviation, float(peak[~split].max()))
+
+        middle = index[first][split]
+        mask[middle] = True
+        starts, ends = (numpy.concatenate((starts[split], middle)),
+                        numpy.concatenate((middle, ends[split])))
+
+    return mask, max_deviation
+
+
+def remapCommands(commands, mask):
+    # command indexes of a route after removing the points where mask is False
+    # (commands placed on removed points move to the next kept point)
+    commands = numpy.array(commands, dtype=float).reshape(-1, 3)
+    if len(commands):
+        kept_before = numpy.concatenate(([0], numpy.cumsum(mask)))
+        k = numpy.clip(commands[:, 0], 0, len(mask)).astype(int)
+        commands[:, 0] = numpy.where(commands[:, 0] < 0, commands[:, 0], kept_before[k])
+
+    return commands
+
+
+def decimatePath(route, tolerance):
+    # reduced version of a route for display: drops the points that deviate
+    # less than tolerance (mm) from the displayed polylines, keeping the
+    # points where a command changes speed or temperature
+    path = WirePath.fromRoute(route)
+    if tolerance <= 0 or len(path) < 3:
+        return path.toRoute()
+
+    keep = numpy.clip(path.commands[:, 0], 0, len(path) - 1).astype(int)
+    mask, deviation = simplifyMask(path.A, path.B, tolerance, keep)
+    return WirePath(path.A[mask], path.B[mask],
+                    remapCommands(path.commands, mask)).toRoute()
+
+
+def matchingPoints(points, targets):
+    # indexes of the points (N,3) that are exactly equal to any of targets
+    targets = set(tuple(p) for p in numpy.asarray(targets, dtype=float).reshape(-1, 3).tolist())
+    return [i for i, p in enumerate(numpy.asarray(points, dtype=float).reshape(-1, 3).tolist())
+            if tuple(p) in targets]
+
+
+def simplifyPath(route, tolerance, anchors=()):
+    # Removes the nearly collinear points of a complete route before export
+    # (paired Douglas-Peucker, see simplifyMask). The points where a command
+    # is placed and the anchors (point indexes) are never dropped.
+    # Returns (route, number of points removed, max deviation in mm)
+    path = WirePath.fromRoute(route)
+    if tolerance <= 0 or len(path) < 3:
+        return path.toRoute(), 0, 0.0
+
+    keep = numpy.concatenate((path.commands[:, 0], numpy.asarray(anchors, dtype=float)))
+    keep = numpy.clip(keep, 0, len(path) - 1).astype(int)
+    mask, deviation = simplifyMask(path.A, path.B, tolerance, keep)
+    simplified = WirePath(path.A[mask], path.B[mask], remapCommands(path.commands, mask))
+    return simplified.toRoute(), len(path) - len(simplified), deviation
+
+
+# Feed planning ----------------------------------------------------------------
+# The machine runs every MOVE at a constant speed, so the speed of a route is
+# set per segment (segment i goes from point i to point i + 1 and its speed is
+# the SPEED command placed at index i + 1). The feed is the speed of the side
+# that travels more. The route speeds (CutSpeed of every object) are the
+# speeds chosen for the material and wire temperature, so they are never
+# exceeded: the planner only slows the path down where the corners of both
+# sides (junction deviation, as grbl) and the acceleration from and to the
+# neighbouring points require it, and gives every segment the mean speed of
+# its trapezoidal profile. Planned routes are therefore never faster than the
+# route as exported without the planner (planFeeds reports both times).
+def segmentSpeeds(path):
+    # (N-1,) speed of every segment given by the route commands (the last one
+    # placed at or before the segment end, the first command otherwise)
+    n = len(path)
+    if len(path.commands) == 0:
+        return numpy.zeros(max(n - 1, 0))
+
+    commands = path.commands[numpy.argsort(path.commands[:, 0], kind='mergesort')]
+    active = numpy.searchsorted(commands[:, 0], numpy.arange(1, n), side='right') - 1
+    return commands[numpy.maximum(active, 0), 1]
+
+
+def junctionSpeeds(A, B, acceleration, deviation):
+    # (N,) max feed at every point: 0 at both ends, the lowest limit of the
+    # two sides at the corners and unlimited (inf) where the path is straight
+    limits = numpy.full(len(A), numpy.inf)
+    for P in (A, B):
+        d = numpy.diff(P, axis=0)
+        length = numpy.sqrt((d**2).sum(axis=1))
+        u = d / numpy.maximum(length, 1e-12)[:, None]
+        # cos of the angle between the incoming and the outgoing directions
+        # (-1 straight, 1 full turn back)
+        cos = numpy.clip(-(u[:-1]*u[1:]).sum(axis=1), -1.0, 1.0)
+        sin_half = numpy.sqrt((1.0 - cos)/2.0)
+        with numpy.errstate(divide='ignore'):
+            v = numpy.sqrt(acceleration*deviation*sin_half/(1.0 - sin_half))
+
+        v[(length[:-1] == 0) | (length[1:] == 0)] = numpy.inf
+        limits[1:-1] = numpy.minimum(limits[1:-1], v)
+
+    limits[[0, -1]] = 0.0
+    return limits
+
+
+def profileSpeeds(length, junctions, caps, acceleration):
+    # (N-1,) mean speed of every segment of lengths length whose speed is at
+    # most caps (N-1,), with the point speeds limited by junctions (N,) and
+    # by the acceleration (trapezoidal profiles)
+    point_caps = junctions.copy()
+    point_caps[:-1] = numpy.minimum(point_caps[:-1], caps)
+    point_caps[1:] = numpy.minimum(point_caps[1:], caps)
+    # squared speeds: w[i+1] <= w[i] + 2*a*L[i] (forward) and
+    # w[i] <= w[i+1] + 2*a*L[i] (backward). With the prefix sums D of 2*a*L
+    # both passes are running minimums of (limit - D)
+    w = point_caps**2
+    D = numpy.concatenate(([0.0], numpy.cumsum(2*acceleration*length)))
+    w = numpy.minimum.accumulate(w - D) + D
+    w = (numpy.minimum.accumulate((w + D)[::-1]) - D[::-1])[::-1]
+    v = numpy.sqrt(numpy.maximum(w, 0.0))
+    v0, v1 = v[:-1], v[1:]
+    peak = numpy.minimum(caps, numpy.sqrt((2*acceleration*length + v0**2 + v1**2)/2))
+    ramps = (2*peak**2 - v0**2 - v1**2)/(2*acceleration)
+    duration = ((2*peak - v0 - v1)/acceleration +
+                numpy.maximum(length - ramps, 0.0)/numpy.maximum(peak, 1e-12))
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return numpy.where(duration > 0, length/duration, peak)
+
+
+def planFeeds(route, max_speed, acceleration, deviation=0.05, speed_step=None):
+    # Returns (route with the planned SPEED commands, planned time, time of
+    # the route as exported without the planner). Both times are those of the
+    # exported program: every segment at the constant speed of its command.
+    # The planned speeds are rounded down to speed_step (max_speed/20 by
+    # default, never over the route speed) and a command is placed wherever
+    # the planned speed changes; the wire temperature of the original
+    # commands is kept
+    path = WirePath.fromRoute(route)
+    n = len(path)
+    if n < 2 or max_speed <= 0 or acceleration <= 0:
+        return path.toRoute(), 0.0, 0.0
+
+    speed_step = speed_step or max_speed/20.0
+    length = numpy.maximum(*sideLengths(path))
+    junctions = junctionSpeeds(path.A, path.B, acceleration, deviation)
+    # segments without a speed set are taken at max_speed
+    route_speeds = segmentSpeeds(path)
+    route_speeds = numpy.where(route_speeds > 0, route_speeds, max_speed)
+    caps = numpy.minimum(route_speeds, max_speed)
+    speeds = profileSpeeds(length, junctions, caps, acceleration)
+    speeds = numpy.minimum(numpy.maximum(numpy.floor(speeds/speed_step), 1)*speed_step, caps)
+    moving = length > 0
+    planned_time = float((length[moving]/speeds[moving]).sum())
+    route_time = float((length[moving]/route_speeds[moving]).sum())
+    planned = WirePath(path.A, path.B, speedCommands(path, speeds))
+    return planned.toRoute(), planned_time, route_time
+
+
+def speedCommands(path, speeds):
+    # (K,3) commands that give every segment of path its speed: one before the
+    # MOVE of every segment whose speed changes, plus the original command
+    # points (the wire temperature of the original commands is kept)
+    n = len(path)
+    temperatures = numpy.zeros(n)
+    if len(path.commands):
+        commands = path.commands[numpy.argsort(path.commands[:, 0], kind='mergesort')]
+        active = numpy.searchsorted(commands[:, 0], numpy.arange(n), side='right') - 1
+        temperatures = commands[numpy.maximum(active, 0), 2]
+
+    segment_of = numpy.clip(numpy.arange(n) - 1, 0, n - 2)
+    indexes = set([0])
+    indexes.update((numpy.nonzero(speeds[1:] != speeds[:-1])[0] + 2).tolist())
+    indexes.update(numpy.clip(path.commands[:, 0], 0, n - 1).astype(int).tolist())
+    indexes = numpy.array(sorted(indexes))
+    return numpy.column_stack((indexes, speeds[segment_of[indexes]],
+                               temperatures[indexes]))
+
+
+# Side speed synchronization ---------------------------------------------------
+# Both sides of a segment are cut in the same time, so on tapered parts the
+# short side moves slower than the route speed (the speed of the faster side)
+# and the wire dwells there. The firmware runs every MOVE at a constant step
+# rate of its longest axis (PathABCD), so the SPEED the machine needs to keep
+# the faster side at the route speed v is the speed of that axis:
+#   feed = v * max(|dAX|, |dAY|, |dBX|, |dBY|) / max(LA, LB)
+def sideLengths(path):
+    # (N-1,) lengths of every segment on side A and on side B
+    return (numpy.sqrt((numpy.diff(path.A, axis=0)**2).sum(axis=1)),
+            numpy.sqrt((numpy.diff(path.B, axis=0)**2).sum(axis=1)))
+
+
+def syncSideSpeeds(route, speed_step=None):
+    # route -> route whose SPEED commands are the firmware feed of every
+    # segment (see above), rounded down to speed_step (1/50 of the highest
+    # route speed by default)
+    path = WirePath.fromRoute(route)
+    if len(path) < 2 or len(path.commands) == 0:
+        return path.toRoute()
+
+    LA, LB = sideLengths(path)
+    longest = numpy.maximum(LA, LB)
+    axis = numpy.abs(numpy.hstack((numpy.diff(path.A[:, :2], axis=0),
+                                   numpy.diff(path.B[:, :2], axis=0)))).max(axis=1)
+    speeds = segmentSpeeds(path)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        feeds = numpy.where(longest > 0, speeds*axis/longest, speeds)
+
+    speed_step = speed_step or speeds.max()/50.0
+    if speed_step > 0:
+        feeds = numpy.maximum(numpy.floor(feeds/speed_step), 1)*speed_step
+
+    return WirePath(path.A, path.B, speedCommands(path, feeds)).toRoute()
+
+
+def dwellReport(route, ratio=0.5, worst=5):
+    # kerf / dwell risk of the segments whose short side travels less than
+    # ratio times the long side (the short side speed is that fraction of the
+    # route speed). Lists the worst segments
+    path = WirePath.fromRoute(route)
+    if len(path) < 2:
+        return 'dwell risk: no segments\n'
+
+    LA, LB = sideLengths(path)
+    longest = numpy.maximum(LA, LB)
+    moving = longest > 0
+    side_ratio = numpy.ones(len(longest))
+    side_ratio[moving] = numpy.minimum(LA, LB)[moving] / longest[moving]
+    speeds = segmentSpeeds(path)
+    risk = numpy.nonzero(moving & (side_ratio < ratio))[0]
+    lines = ['dwell risk (short/long side < %.2f): %d of %d segments, %.1f mm of the long side'
+             % (ratio, len(risk), int(moving.sum()), float(longest[risk].sum()))]
+    for limit in (0.25, 0.1):
+        severe = risk[side_ratio[risk] < limit]
+        lines.append('  < %.2f: %d segments, %.1f mm' % (limit, len(severe),
+                                                       float(longest[severe].sum())))
+
+    for i in risk[numpy.argsort(side_ratio[risk], kind='mergesort')][:worst].tolist():
+        short_side = 'A' if LA[i] < LB[i] else 'B'
+        lines.append('  segment %d (points %d-%d): side %s %.3f of %.3f mm, ratio %.3f, '
+                     'short side at %.2f of speed %.2f'
+                     % (i, i, i + 1, short_side, min(LA[i], LB[i]), longest[i],
+                        side_ratio[i], speeds[i]*side_ratio[i], speeds[i]))
+
+    return '\n'.join(lines) + '\n'
+
+
+# Automatic link routing -------------------------------------------------------
+# A link leaves a path at any of its points, cuts the whole linked path and
+# comes back, so every link is travelled twice whatever the visiting order and
+# the shortest set of links is the minimum spanning tree between the paths.
+# Distances are measured on both machine sides at once: the 4D points
+# (AX, AY, BX, BY) scaled by 1/sqrt(2), so a link whose sides move the same
+# distance measures that distance.
+def linkFeatures(A, B):
+    # (N,4) link metric coordinates of the paired side points
+    A = numpy.asarray(A, dtype=float).reshape(-1, 3)
+    B = numpy.asarray(B, dtype=float).reshape(-1, 3)
+    return numpy.hstack((A[:, :2], B[:, :2])) / 2**0.5
+
+
+def closestPair(F_i, F_j, a=0, b=0, iterations=4):
+    # closest points between two paths (feature arrays), refined from the
+    # guess (a, b) by alternating nearest point searches.
+    # Returns (index in i, index in j, distance)
+    for k in range(iterations):
+        a_new = int(((F_i - F_j[b])**2).sum(axis=1).argmin())
+        b_new = int(((F_j - F_i[a_new])**2).sum(axis=1).argmin())
+        if a_new == a and b_new == b:
+            break
+
+        a, b = a_new, b_new
+
+    return a, b, float(numpy.sqrt(((F_i[a] - F_j[b])**2).sum()))
+
+
+def routeLinks(paths, root=0, samples=48):
+    # Chooses the links between paths (list of (side_A, side_B)) that join all
+    # of them to paths[root] with minimum total length, using Prim's algorithm.
+    # The distance between two paths is only computed when Prim is about to
+    # take it: until then the distance between their bounding boxes (a lower
+    # bound) is used, so far apart paths are never compared. Distances are
+    # measured between samples points of each path, the chosen links are then
+    # refined to the closest points of the full paths (closestPair).
+    # Returns the links from the root outwards as
+    # (parent, parent_index, child, child_index, length) tuples
+    features = [linkFeatures(A, B) for A, B in paths]
+    P = len(features)
+    if P < 2:
+        return []
+
+    low = numpy.array([F.min(axis=0) for F in features])
+    high = numpy.array([F.max(axis=0) for F in features])
+    gap = numpy.maximum(0.0, numpy.maximum(low[:, None] - high[None, :],
+                                           low[None, :] - high[:, None]))
+    D = numpy.sqrt((gap**2).sum(axis=2))
+    exact = numpy.zeros((P, P), dtype=bool)
+    pairs = {}
+    sampled = [numpy.arange(0, len(F), max(1, len(F) // samples)) for F in features]
+
+    def evaluate(i, j):
+        S_i = features[i][sampled[i]]
+        S_j = features[j][sampled[j]]
+        d2 = ((S_i[:, None] - S_j[None, :])**2).sum(axis=2)
+        k = int(d2.argmin())
+        D[i, j] = D[j, i] = d2.flat[k]**0.5
+        exact[i, j] = exact[j, i] = True
+        pairs[(i, j)] = (sampled[i][k // len(S_j)], sampled[j][k % len(S_j)])
+        pairs[(j, i)] = pairs[(i, j)][::-1]
+
+    in_tree = numpy.zeros(P, dtype=bool)
+    in_tree[root] = True
+    best = D[root].copy()
+    parent = numpy.full(P, root)
+    links = []
+    while len(links) < P - 1:
+        child = int(numpy.where(in_tree, numpy.inf, best).argmin())
+        p = int(parent[child])
+        if not(exact[p, child]):
+            # replace the bound and look again for the closest tree path
+            evaluate(p, child)
+            column = numpy.where(in_tree, D[:, child], numpy.inf)
+            parent[child] = column.argmin()
+            best[child] = column[parent[child]]
+            continue
+
+        a, b, length = closestPair(features[p], features[child], *pairs[(p, child)])
+        links.append((p, a, child, b, length))
+        in_tree[child] = True
+        closer = ~in_tree & (D[child] < best)
+        best[closer] = D[child][closer]
+        parent[closer] = child
+
+    return links
+
+
+def chainLength(paths, order=None):
+    # total link length of visiting paths one after the other (in order)
+    features = [linkFeatures(A, B) for A, B in paths]
+    if order is None:
+        order = range(len(features))
+
+    order = list(order)
+    return sum(closestPair(features[order[k]], features[order[k + 1]])[2]
+               for k in range(len(order) - 1))
+
+
+def projectToPlanes(PA, PB, Z0, Z1):
+    # projects the wire line PA-PB (part points) to the machine workplanes
+    # placed at Z0 (side A) and Z1 (side B): the points of the line
+    # PA + (PB - PA)*t at those z
+    d = [PB[0]-PA[0], PB[1]-PA[1], PB[2]-PA[2]]
+    if d[2] == 0:
+        raise ValueError('wire line parallel to the machine planes')
+
+    ta = (Z0 - PA[2]) / d[2]
+    tb = (Z1 - PA[2]) / d[2]
+    projected_pa = (PA[0] + d[0]*ta, PA[1] + d[1]*ta, float(Z0))
+    projected_pb = (PA[0] + d[0]*tb, PA[1] + d[1]*tb, float(Z1))
+    return projected_pa, projected_pb
+
+
+def projectRouteToPlanes(A, B, Z0, Z1):
+    # projectToPlanes for whole paths: A, B -> (N,3) part points of both
+    # sides, returns the (N,3) arrays of the wire projected to Z0 and Z1
+    A = numpy.asarray(A, dtype=float).reshape(-1, 3)
+    B = numpy.asarray(B, dtype=float).reshape(-1, 3)
+    d = B - A
+    flat = numpy.nonzero(d[:, 2] == 0)[0]
+    if len(flat):
+        raise ValueError('wire line parallel to the machine planes at point ' +
+                         str(int(flat[0])))
+
+    projected_A = A + d*((Z0 - A[:, 2]) / d[:, 2])[:, None]
+    projected_B = A + d*((Z1 - A[:, 2]) / d[:, 2])[:, None]
+    # exact plane heights (no rounding from the line parameter)
+    projected_A[:, 2] = Z0
+    projected_B[:, 2] = Z1
+    return projected_A, projected_B
+
+
+class PointIndex:
+    # Grid hash over the points of a raw path (both machine sides) that
+    # answers nearest point queries without scanning the whole path.
+    # Points are stored by their quantized XYZ cell, a query only visits the
+    # cells around the query point, growing the search ring until no closer
+    # point can exist.
+    def __init__(self, raw_path, cell_size=None):
+        points = []
+        for side in raw_path:
+            for i in range(len(side)):
+                points.append((side[i][0], side[i][1], side[i][2], i))
+
+        if cell_size is None:
+            cell_size = 1.0
+            if points:
+                span = max(max(p[k] for p in points) - min(p[k] for p in points)
+                           for k in range(3))
+                cell_size = max(span / len(points)**0.5, 0.001)
+
+        self.cell_size = cell_size
+        self.points = points
+        self.grid = {}
+        for p in points:
+            self.grid.setdefault(self.cellOf(p), []).append(p)
+
+        self.bounds = None
+        if self.grid:
+            keys = list(self.grid.keys())
+            self.bounds = ([min(k[a] for k in keys) for a in range(3)],
+                           [max(k[a] for k in keys) for a in range(3)])
+
+    def cellOf(self, point):
+        return (int(point[0] // self.cell_size),
+                int(point[1] // self.cell_size),
+                int(point[2] // self.cell_size))
+
+    def nearest(self, point):
+        # returns (index, distance) of the path point closest to point
+        # (None, None) for an empty path
+        if self.bounds is None:
+            return None, None
+
+        c = self.cellOf(point)
+        kmin, kmax = self.bounds
+        best_index = None
+        best_d2 = None
+        # rings closer than the occupied bounds are empty: start at the first
+        # one that reaches them, and stop once a ring contains all of them
+        r = max(max(kmin[a] - c[a], c[a] - kmax[a], 0) for a in range(3))
+        r_last = max(max(c[a] - kmin[a], kmax[a] - c[a]) for a in range(3))
+        while True:
+            # ring r = cells at chebyshev distance r, clipped to occupied bounds
+            ranges = [range(max(c[a] - r, kmin[a]), min(c[a] + r, kmax[a]) + 1)
+                      for a in range(3)]
+            if len(ranges[0])*len(ranges[1])*len(ranges[2]) > len(self.grid):
+                # the query is far from the path, scanning everything is cheaper
+                for p in self.points:
+                    d2 = ((p[0]-point[0])**2 + (p[1]-point[1])**2 +
+                          (p[2]-point[2])**2)
+                    if best_d2 is None or d2 < best_d2:
+                        best_d2 = d2
+                        best_index = p[3]
+
+                break
+
+            for kx in ranges[0]:
+                for ky in ranges[1]:
+                    for kz in ranges[2]:
+                        if max(abs(kx-c[0]), abs(ky-c[1]), abs(kz-c[2])) != r:
+                            continue  # inner cells already visited
+
+                        for p in self.grid.get((kx, ky, kz), ()):
+                            d2 = ((p[0]-point[0])**2 + (p[1]-point[1])**2 +
+                                  (p[2]-point[2])**2)
+                            if best_d2 is None or d2 < best_d2:
+                                best_d2 = d2
+                                best_index = p[3]
+
+            # any point outside this ring is at least r*cell_size away
+            if best_d2 is not None and (best_d2**0.5 <= r*self.cell_size or r >= r_last):
+                break
+
+            r += 1
+
+        return best_index, best_d2**0.5
+
+
+# .nicr files -----------------------------------------------------------------
+def formatMoves(moves):
+    # moves -> (N,4) array of AX AY BX BY. Returns the MOVE lines as a single
+    # string, formatted in one call with a fixed 3 decimals precision
+    return ('MOVE %.3f %.3f %.3f %.3f\n' * len(moves)) % tuple(moves.ravel().tolist())
+
+
+# program instructions other than MOVE, stored as a table of
+# [move_index, opcode, value] rows: the instruction goes before MOVE move_index
+OPCODES = ('INIT', 'POWER', 'WIRE', 'SPEED', 'END')
+OP_INIT, OP_POWER, OP_WIRE, OP_SPEED, OP_END = range(5)
+
+HEADER_KEYS = ('PATH NAME', 'DATE', 'EXPORTER VERSION', 'Z AXIS LENGTH',
+               'MAX FEED SPEED', 'MAX WIRE TEMPERATURE')
+
+
+def programHeader(path_name, zlength, mxspeed, mxtemp, planes=None):
+    header = {'PATH NAME': path_name,
+              'DATE': time.strftime("%c"),
+              'EXPORTER VERSION': '0.2',
+              'Z AXIS LENGTH': zlength,
+              'MAX FEED SPEED': mxspeed,
+              'MAX WIRE TEMPERATURE': mxtemp}
+    if planes is not None:
+        header['FRAME PLANES'] = '%.3f %.3f' % (planes[0], planes[1])
+
+    return header
+
+
+def programMoves(path, zero_point, planes=None):
+    # (N,4) AX AY BX BY array with compensation for virtual machine ZeroPoint.
+    # With planes=(Z0, Z1) the coordinates are the wire projected to the
+    # machine frame planes instead of the part points
+    A, B = path.A, path.B
+    if planes is not None:
+        A, B = projectRouteToPlanes(A, B, planes[0], planes[1])
+
+    moves = numpy.empty((len(path), 4))
+    moves[:, 0:2] = A[:, :2] - (zero_point[0], zero_point[1])
+    moves[:, 2:4] = B[:, :2] - (zero_point[0], zero_point[1])
+    return moves
+
+
+def programTable(path):
+    # instruction table of a route: machine start, the speed and temperature
+    # commands before the MOVE of their point index and machine shutdown
+    n = len(path)
+    table = [[0, OP_INIT, 0.0], [0, OP_POWER, 1.0]]
+    commands = path.commands[numpy.argsort(path.commands[:, 0], kind='mergesort')]
+    for cmd in commands.tolist():
+        index = min(max(int(cmd[0]), 0), n)
+        table.append([index, OP_WIRE, cmd[2]])
+        table.append([index, OP_SPEED, cmd[1]])
+
+    table.append([n, OP_POWER, 0.0])
+    table.append([n, OP_END, 0.0])
+    return table
+
+
+def instructionLine(opcode, value):
+    if opcode == OP_POWER:
+        return 'POWER ' + ('ON' if value else 'OFF')
+
+    if opcode in (OP_WIRE, OP_SPEED):
+        return OPCODES[opcode] + ' ' + str(value)
+
+    return OPCODES[opcode]
+
+
+def writeNiCrText(nicr_file, header, moves, table, chunk_size=20000):
+    # writes header, MOVE lines and instruction table as .nicr text. The MOVE
+    # lines are formatted and written in blocks of chunk_size lines
+    lines = ['PATH NAME:' + str(header.get('PATH NAME', '')),
+             'DATE: ' + str(header.get('DATE', '')),
+             'Exporter version ' + str(header.get('EXPORTER VERSION', '')),
+             'SETTINGS ------------------------- ',
+             'Z AXIS LENGTH: ' + str(header.get('Z AXIS LENGTH', 0.0)),
+             'MAX FEED SPEED: ' + str(header.get('MAX FEED SPEED', 0.0)),
+             'MAX WIRE TEMPERATURE: ' + str(header.get('MAX WIRE TEMPERATURE', 0.0))]
+    for key in sorted(header):
+        if key not in HEADER_KEYS:
+            lines.append(key + ': ' + str(header[key]))
+
+    lines.append('END SETTINGS --------------------- ')
+    nicr_file.write('\n'.join(lines) + '\n')
+    start = 0
+    last = len(table) - 1
+    for j in range(len(table)):
+        index = min(max(int(table[j][0]), start), len(moves))
+        for i in range(start, index, chunk_size):
+            nicr_file.write(formatMoves(moves[i:min(i + chunk_size, index)]))
+
+        start = index
+        # the last instruction (END) closes the file without line break
+        nicr_file.write(instructionLine(int(table[j][1]), table[j][2]) +
+                        ('' if j == last else '\n'))
+
+    for i in range(start, len(moves), chunk_size):
+        nicr_file.write(formatMoves(moves[i:i + chunk_size]))
+
+
+def writeNiCrProgram(nicr_file, route, zero_point, path_name, zlength,
+                     mxspeed, mxtemp, chunk_size=20000, planes=None):
+    # writes a complete route as .nicr instructions to the open nicr_file.
+    # Coordinates are written relative to zero_point (x, y), projected to the
+    # frame planes (Z0, Z1) if planes is given
+    path = WirePath.fromRoute(route)
+    writeNiCrText(nicr_file,
+                  programHeader(path_name, zlength, mxspeed, mxtemp, planes),
+                  programMoves(path, zero_point, planes),
+                  programTable(path),
+                  chunk_size)
+
+
+# .nicr grammar (one instruction per line, fields separated by any whitespace)
+#   header:   KEY: value  (PATH NAME, DATE, Z AXIS LENGTH, MAX FEED SPEED,
+#                          MAX WIRE TEMPERATURE)
+#             Exporter version <version>
+#             SETTINGS ---   /   END SETTINGS ---   (section markers)
+#   program:  INIT | POWER ON|OFF | WIRE <temp> | SPEED <speed> |
+#             MOVE <AX> <AY> <BX> <BY> | END
+# parseNiCrProgram yields one NiCrRecord per instruction:
+#   kind -> 'HEADER', 'INIT', 'POWER', 'WIRE', 'SPEED', 'MOVE' or 'END'
+#   args -> HEADER: (key, value), POWER: ('ON',) or ('OFF',),
+#           WIRE/SPEED: (value,), MOVE: (AX, AY, BX, BY), INIT/END: ()
+NiCrRecord = collections.namedtuple('NiCrRecord', ['line', 'kind', 'args'])
+
+NUMERIC_HEADER_KEYS = ('Z AXIS LENGTH', 'MAX FEED SPEED', 'MAX WIRE TEMPERATURE')
+
+
+class NiCrFileError(ValueError):
+    def __init__(self, line, msg):
+        ValueError.__init__(self, 'line ' + str(line) + ': ' + msg)
+        self.line = line
+
+
+def _numbers(line_number, fields, count):
+    if len(fields) != count + 1:
+        raise NiCrFileError(line_number, fields[0] + ' takes ' + str(count) +
+                            ' values, got ' + str(len(fields) - 1))
+
+    try:
+        return tuple(float(f) for f in fields[1:])
+
+    except ValueError:
+        raise NiCrFileError(line_number, 'invalid number in ' + ' '.join(fields))
+
+
+def parseNiCrProgram(nicr_file):
+    # generator over the instructions of an open .nicr file (or any iterable
+    # of lines). Only one line is held in memory at a time
+    line_number = 0
+    for line in nicr_file:
+        line_number += 1
+        fields = line.split()
+        if not fields:
+            continue
+
+        keyword = fields[0].upper()
+        if keyword == 'MOVE':
+            yield NiCrRecord(line_number, 'MOVE', _numbers(line_number, fields, 4))
+
+        elif keyword in ('WIRE', 'SPEED'):
+            yield NiCrRecord(line_number, keyword, _numbers(line_number, fields, 1))
+
+        elif keyword == 'POWER':
+            if len(fields) != 2 or fields[1].upper() not in ('ON', 'OFF'):
+                raise NiCrFileError(line_number, 'expected POWER ON or POWER OFF')
+
+            yield NiCrRecord(line_number, 'POWER', (fields[1].upper(),))
+
+        elif keyword in ('INIT', 'END') and len(fields) == 1:
+            yield NiCrRecord(line_number, keyword, ())
+
+        elif keyword == 'SETTINGS' or (keyword == 'END' and
+                                       fields[1].upper() == 'SETTINGS'):
+            continue
+
+        elif keyword == 'EXPORTER':
+            yield NiCrRecord(line_number, 'HEADER',
+                             ('EXPORTER VERSION', ' '.join(fields[2:])))
+
+        elif ':' in line:
+            key, value = line.split(':', 1)
+            key = ' '.join(key.split()).upper()
+            value = value.strip()
+            if key in NUMERIC_HEADER_KEYS:
+                try:
+                    value = float(value)
+
+                except ValueError:
+                    raise NiCrFileError(line_number, 'invalid number in ' + key)
+
+            yield NiCrRecord(line_number, 'HEADER', (key, value))
+
+        else:
+            raise NiCrFileError(line_number, 'unknown instruction ' + fields[0])
+
+
+class WirePathBuilder:
+    # Consumer of parseNiCrProgram records that builds a WirePath. Points are
+    # stored in flat double arrays (no python object per point) and the WIRE
+    # and SPEED instructions become commands at the index of the next MOVE
+    def __init__(self):
+        self.header = {}
+        self.moves = array.array('d')
+        self.commands = []
+        self.speed = 0.0
+        self.temperature = 0.0
+        self.n = 0
+
+    def add(self, record):
+        if record.kind == 'MOVE':
+            if 'Z AXIS LENGTH' not in self.header:
+                raise NiCrFileError(record.line, 'MOVE before Z AXIS LENGTH')
+
+            self.moves.extend(record.args)
+            self.n += 1
+
+        elif record.kind in ('WIRE', 'SPEED'):
+            self.command(self.n, record.kind, record.args[0])
+
+        elif record.kind == 'HEADER':
+            self.header[record.args[0]] = record.args[1]
+
+    def command(self, index, kind, value):
+        # WIRE or SPEED instruction placed before MOVE index
+        if kind == 'WIRE':
+            self.temperature = value
+
+        else:
+            self.speed = value
+
+        if self.commands and self.commands[-1][0] == index:
+            self.commands[-1] = [index, self.speed, self.temperature]
+
+        else:
+            self.commands.append([index, self.speed, self.temperature])
+
+    def wirePath(self):
+        zlength = self.header.get('Z AXIS LENGTH', 0.0)
+        moves = numpy.frombuffer(self.moves, dtype=float).reshape(-1, 4)
+        A = numpy.zeros((self.n, 3))
+        B = numpy.empty((self.n, 3))
+        A[:, :2] = moves[:, 0:2]
+        B[:, :2] = moves[:, 2:4]
+        B[:, 2] = zlength
+        return WirePath(A, B, self.commands)
+
+
+def validateNiCrProgram(nicr_file):
+    # checks the structure of an open .nicr file in constant memory and
+    # returns a summary dict. Raises NiCrFileError on the first problem
+    summary = {'header': {}, 'moves': 0, 'commands': 0}
+    started = False
+    ended = False
+    last_line = 0
+    for record in parseNiCrProgram(nicr_file):
+        last_line = record.line
+        if ended:
+            raise NiCrFileError(record.line, 'instruction after END')
+
+        if record.kind == 'HEADER':
+            summary['header'][record.args[0]] = record.args[1]
+
+        elif record.kind == 'INIT':
+            started = True
+
+        elif not(started):
+            raise NiCrFileError(record.line, record.kind + ' before INIT')
+
+        elif record.kind == 'MOVE':
+            summary['moves'] += 1
+
+        elif record.kind == 'END':
+            ended = True
+
+        else:
+            summary['commands'] += 1
+
+    if not(ended):
+        raise NiCrFileError(last_line, 'missing END')
+
+    return summary
+
+
+def readNiCrProgram(nicr_file):
+    # reads an open .nicr file into a WirePath (side A at z=0, side B placed
+    # at the Z AXIS LENGTH of the header)
+    builder = WirePathBuilder()
+    for record in parseNiCrProgram(nicr_file):
+        builder.add(record)
+
+    return builder.wirePath()
+
+
+# .nicrb binary programs --------------------------------------------------------
+# Little endian file made of:
+#   header      NICRB_HEADER (48 bytes): magic, version, record type, number of
+#               moves, number of instructions, metadata length, Z AXIS LENGTH,
+#               MAX FEED SPEED, MAX WIRE TEMPERATURE and 4 steps/mm scales
+#               (MA, MB, MC, MD; only used by the steps record type)
+#   metadata    JSON text header (PATH NAME, DATE...), padded to 8 bytes
+#   table       instructions: int32 move_index, int32 opcode, float64 value
+#   moves       AX AY BX BY per MOVE, float32 mm (NICRB_FLOAT) or int32
+#               absolute steps (NICRB_STEPS), or int16 step blocks
+#               (NICRB_BLOCKS, see stepBlocks)
+NICRB_MAGIC = b'NCRB'
+NICRB_VERSION = 1
+NICRB_FLOAT, NICRB_STEPS, NICRB_BLOCKS = 0, 1, 2
+NICRB_HEADER = struct.Struct('<4sHHIII3f4f')
+NICRB_TABLE_DTYPE = numpy.dtype([('index', '<i4'), ('opcode', '<i4'), ('value', '<f8')])
+NICRB_MOVE_DTYPES = {NICRB_FLOAT: numpy.dtype('<f4'), NICRB_STEPS: numpy.dtype('<i4'),
+                     NICRB_BLOCKS: numpy.dtype('<i2')}
+BLOCK_LIMIT = 32765  # max |motor steps| of a block (int16, split margin)
+
+
+def _pad8(n):
+    return (8 - n % 8) % 8
+
+
+# Step blocks: the host does the work of PathABCD. Every MOVE becomes the
+# signed steps of the coreXY motors from the previous MOVE (the first one from
+# machine zero):
+#   DA = DX + DY, DB = DX - DY   (side A: MA MB, side B: MC MD)
+# with D* = round(mm*scale) axis steps. The machine runs each block as an
+# integer Bresenham line over max(|DA|, |DB|, |DC|, |DD|) step events (see
+# NiCrKinematics.bresenhamSteps), one step per motor at most per event.
+# Moves over BLOCK_LIMIT motor steps are split into several blocks and the
+# instruction table indexes point to the blocks.
+def coreXYSteps(deltas):
+    # (N,4) axis steps AX AY BX BY -> (N,4) motor steps MA MB MC MD
+    deltas = numpy.asarray(deltas)
+    return numpy.column_stack((deltas[:, 0] + deltas[:, 1], deltas[:, 0] - deltas[:, 1],
+                               deltas[:, 2] + deltas[:, 3], deltas[:, 2] - deltas[:, 3]))
+
+
+def blockAxisSteps(blocks):
+    # (N,4) motor steps -> (N,4) axis steps (inverse of coreXYSteps)
+    blocks = numpy.asarray(blocks, dtype=numpy.int64)
+    return numpy.column_stack(((blocks[:, 0] + blocks[:, 1]) // 2,
+                               (blocks[:, 0] - blocks[:, 1]) // 2,
+                               (blocks[:, 2] + blocks[:, 3]) // 2,
+                               (blocks[:, 2] - blocks[:, 3]) // 2))
+
+
+def stepBlocks(moves, table, scale):
+    # moves (N,4) mm, table [[move_index, opcode, value]...] -> (M,4) int64
+    # motor step blocks and the table with block indexes
+    moves = numpy.asarray(moves, dtype=float).reshape(-1, 4)
+    steps = numpy.round(moves*numpy.asarray(scale, dtype=float)).astype(numpy.int64)
+    deltas = numpy.diff(steps, axis=0, prepend=numpy.zeros((1, 4), numpy.int64))
+    longest = numpy.abs(coreXYSteps(deltas)).max(axis=1)
+    parts = numpy.maximum(1, -(-longest // BLOCK_LIMIT))
+    first = numpy.cumsum(parts) - parts
+    owner = numpy.repeat(numpy.arange(len(deltas)), parts)
+    k = (numpy.arange(len(owner)) - first[owner])[:, None]
+    n = parts[owner][:, None]
+    # part k of a split move takes floor((k+1)*d/n) - floor(k*d/n) axis steps
+    split = (k + 1)*deltas[owner] // n - k*deltas[owner] // n
+    first = numpy.append(first, len(owner))
+    table = [[int(first[min(max(int(row[0]), 0), len(deltas))]), row[1], row[2]]
+             for row in table]
+    return coreXYSteps(split.reshape(-1, 4)), table
+
+
+def writeNiCrBinary(binary_file, header, moves, table, record_type=NICRB_FLOAT,
+                    scale=(1.0, 1.0, 1.0, 1.0)):
+    # writes moves ((N,4) mm array) and instruction table to the open binary
+    # file. In NICRB_STEPS mode the coordinates are stored as round(mm*scale)
+    moves = numpy.asarray(moves, dtype=float).reshape(-1, 4)
+    if record_type == NICRB_BLOCKS:
+        records, table = stepBlocks(moves, table, scale)
+        records = records.astype(NICRB_MOVE_DTYPES[NICRB_BLOCKS])
+
+    elif record_type == NICRB_STEPS:
+        records = numpy.round(moves*numpy.asarray(scale, dtype=float))
+        records = records.astype(NICRB_MOVE_DTYPES[NICRB_STEPS])
+
+    else:
+        records = moves.astype(NICRB_MOVE_DTYPES[NICRB_FLOAT])
+        scale = (0.0, 0.0, 0.0, 0.0)
+
+    rows = numpy.zeros(len(table), dtype=NICRB_TABLE_DTYPE)
+    for j in range(len(table)):
+        rows[j] = (int(table[j][0]), int(table[j][1]), table[j][2])
+
+    meta = json.dumps(header, sort_keys=True).encode('utf-8')
+    meta += b' '*_pad8(NICRB_HEADER.size + len(meta))
+    binary_file.write(NICRB_HEADER.pack(NICRB_MAGIC, NICRB_VERSION, record_type,
+                                        len(records), len(rows), len(meta),
+                                        header.get('Z AXIS LENGTH', 0.0),
+                                        header.get('MAX FEED SPEED', 0.0),
+                                        header.get('MAX WIRE TEMPERATURE', 0.0),
+                                        *scale))
+    binary_file.write(meta)
+    binary_file.write(rows.tobytes())
+    binary_file.write(records.tobytes())
+
+
+def writeNiCrBinaryProgram(binary_file, route, zero_point, path_name, zlength,
+                           mxspeed, mxtemp, record_type=NICRB_FLOAT,
+                           scale=(1.0, 1.0, 1.0, 1.0), planes=None):
+    # binary sibling of writeNiCrProgram
+    path = WirePath.fromRoute(route)
+    writeNiCrBinary(binary_file,
+                    programHeader(path_name, zlength, mxspeed, mxtemp, planes),
+                    programMoves(path, zero_point, planes),
+                    programTable(path),
+                    record_type, scale)
+
+
+class NiCrBinaryProgram:
+    # Memory mapped .nicrb reader. moves and table are numpy views of the
+    # mapped file (no copy, pages are loaded on access). Views taken from them
+    # must be released before close()
+    def __init__(self, file_name):
+        self.file = open(file_name, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        # mmap can not map an empty file
+        if size < NICRB_HEADER.size:
+            self.file.close()
+            raise NiCrFileError(0, 'truncated .nicrb header')
+
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse(size)
+
+        except NiCrFileError:
+            self.close()
+            raise
+
+        except (ValueError, KeyError, UnicodeDecodeError) as e:
+            self.close()
+            raise NiCrFileError(0, 'invalid .nicrb file (' + str(e) + ')')
+
+    def _parse(self, size):
+        fields = NICRB_HEADER.unpack_from(self.map, 0)
+        magic, version, record_type, n_moves, n_table, meta_len = fields[:6]
+        if magic != NICRB_MAGIC or version != NICRB_VERSION:
+            raise NiCrFileError(0, 'not a .nicrb version ' + str(NICRB_VERSION) + ' file')
+
+        if record_type not in NICRB_MOVE_DTYPES:
+            raise NiCrFileError(0, 'unknown .nicrb record type ' + str(record_type))
+
+        table_offset = NICRB_HEADER.size + meta_len
+        moves_offset = table_offset + n_table*NICRB_TABLE_DTYPE.itemsize
+        end = moves_offset + 4*n_moves*NICRB_MOVE_DTYPES[record_type].itemsize
+        if size < end:
+            raise NiCrFileError(0, 'truncated .nicrb file (' + str(size) + ' of ' +
+                                str(end) + ' bytes)')
+
+        self.record_type = record_type
+        self.scale = numpy.array(fields[9:13], dtype=float)
+        self.header = json.loads(self.map[NICRB_HEADER.size:table_offset].decode('utf-8'))
+        self.table = numpy.frombuffer(self.map, dtype=NICRB_TABLE_DTYPE,
+                                      count=n_table, offset=table_offset)
+        self.moves = numpy.frombuffer(self.map, dtype=NICRB_MOVE_DTYPES[record_type],
+                                      count=4*n_moves, offset=moves_offset).reshape(-1, 4)
+
+    def __len__(self):
+        return len(self.moves)
+
+    def coordinates(self):
+        # (N,4) float64 mm array of the moves (copy)
+        if self.record_type == NICRB_BLOCKS:
+            return numpy.cumsum(blockAxisSteps(self.moves), axis=0) / self.scale
+
+        if self.record_type == NICRB_STEPS:
+            return self.moves / self.scale
+
+        return self.moves.astype(float)
+
+    def wirePath(self):
+        zlength = self.header.get('Z AXIS LENGTH', 0.0)
+        moves = self.coordinates()
+        A = numpy.zeros((len(moves), 3))
+        B = numpy.empty((len(moves), 3))
+        A[:, :2] = moves[:, 0:2]
+        B[:, :2] = moves[:, 2:4]
+        B[:, 2] = zlength
+        builder = WirePathBuilder()
+        for row in self.table.tolist():
+            if row[1] in (OP_WIRE, OP_SPEED):
+                builder.command(row[0], OPCODES[row[1]], row[2])
+
+        return WirePath(A, B, builder.commands)
+
+    def close(self):
+        self.table = None
+        self.moves = None
+        self.map.close()
+        self.file.close()
+
+
+def nicrTextToBinary(nicr_file, binary_file, record_type=NICRB_FLOAT,
+                     scale=(1.0, 1.0, 1.0, 1.0)):
+    # converts an open .nicr text file into an open .nicrb binary file
+    header = {}
+    moves = array.array('d')
+    table = []
+    n = 0
+    for record in parseNiCrProgram(nicr_file):
+        if record.kind == 'MOVE':
+            moves.extend(record.args)
+            n += 1
+
+        elif record.kind == 'HEADER':
+            header[record.args[0]] = record.args[1]
+
+        elif record.kind == 'POWER':
+            table.append([n, OP_POWER, 1.0 if record.args[0] == 'ON' else 0.0])
+
+        else:
+            value = record.args[0] if record.args else 0.0
+            table.append([n, OPCODES.index(record.kind), value])
+
+    writeNiCrBinary(binary_file, header,
+                    numpy.frombuffer(moves, dtype=float).reshape(-1, 4),
+                    table, record_type, scale)
+
+
+def nicrBinaryToText(binary_name, nicr_file, chunk_size=20000):
+    # converts the .nicrb file binary_name into an open .nicr text file
+    program = NiCrBinaryProgram(binary_name)
+    try:
+        writeNiCrText(nicr_file, program.header, program.coordinates(),
+                      program.table.tolist(), chunk_size)
+
+    finally:
+        program.close()
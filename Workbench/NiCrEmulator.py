@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+# NiCr (Hot Wire CNC Cutter) workbench for FreeCAD
+# (c) 2016 Javier Martínez García
+#***************************************************************************
+#*   (c) Javier Martínez García 2016                                       *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License (GPL)            *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Lesser General Public License for more details.                   *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with FreeCAD; if not, write to the Free Software        *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************/
+
+import json
+import os
+import re
+import select
+import threading
+import time
+import numpy
+import NiCrKinematics
+
+# Emulator of Firmware/NiCrFW.ino on a pseudo terminal (POSIX only), to test
+# senders and protocol changes without the machine:
+#   emulator = NiCrEmulator.FirmwareEmulator()
+#   NiCrSender.sendNiCrFile('program.nicr', emulator.port_name)
+#   emulator.close()
+#   print(emulator.report())
+# loop() is reproduced as written: 10 ms after the first byte everything that
+# arrived is read as one instruction into the 25 char raw_instruction buffer
+# and split at spaces into 5 fields (a line break stays in the last field it
+# touches, and a second instruction read in the same buffer is lost). With
+# line_buffered=True the emulator reads the serial buffer (rx_size bytes) line
+# by line instead (lines up to rx_size chars, no 10 ms wait), as a firmware
+# that supports pipelined instructions would.
+# The answers are the firmware ones (instruction echo, 'Wire temperature set
+# to: ', one empty line per PathABCD iteration, DONE) and every instruction
+# takes the time NiCrKinematics models for it (buffer delay, serial output
+# and two pulses of variable_high_delay + variable_low_delay per iteration),
+# scaled by time_scale (1 = real time, 0 = as fast as possible).
+# Every MOVE is recorded in the step stream: signed steps AX AY BX BY, step
+# pulses of the motors MA MB MC MD and PathABCD iterations. MOVE values are
+# absolute positions (the convention of NiCrKinematics and NiCrSender, and
+# what the workbench exports): with absolute=True (default) the emulator
+# moves by the difference to the previous MOVE. NiCrFW.ino as written gives
+# the scaled fields to PathABCD as steps to move, absolute=False reproduces
+# that.
+# With sequenced=True (line buffered firmware) instructions come as
+# 'N<seq> <instruction>': every sequence number is executed once, in order,
+# and answered with 'DONE <seq>'; repeated ones are only answered again and
+# the ones after a gap are ignored until the missing one is resent.
+
+ACK = 'DONE'
+
+_FLOAT = re.compile(r'\s*[-+]?(\d+\.?\d*|\.\d+)')
+_INT = re.compile(r'\s*[-+]?\d+')
+
+
+def toFloat(text):
+    # Arduino String.toFloat(): leading number of text, 0 if there is none
+    match = _FLOAT.match(text)
+    return float(match.group(0)) if match else 0.0
+
+
+def toInt(text):
+    # Arduino String.toInt()
+    match = _INT.match(text)
+    return int(match.group(0)) if match else 0
+
+
+def decodeInstruction(raw, size=25):
+    # complete_instruction of loop(): the first 5 space separated fields of
+    # the raw_instruction buffer
+    fields = raw[:size].ljust(size).split(' ')
+    return (fields + [''] * 5)[:5]
+
+
+class FirmwareEmulator:
+    def __init__(self, settings=None, time_scale=0.0, line_buffered=False,
+                 rx_size=64, absolute=True, record_increments=False, drop=(),
+                 sequenced=False):
+        import tty
+        self.settings = settings or NiCrKinematics.FirmwareSettings()
+        self.time_scale = time_scale
+        self.line_buffered = line_buffered
+        self.rx_size = rx_size  # bytes of the Arduino serial receive buffer
+        self.absolute = absolute
+        self.record_increments = record_increments  # keep the PathABCD steps
+        self.drop = set(drop)  # indexes of received instructions to ignore
+        self.sequenced = sequenced
+        self.last_seq = -1  # last sequence number executed
+        self.repeated = 0  # repeated sequence numbers received
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.port_name = os.ttyname(self.slave)  # the sender connects here
+        self.initialized = False
+        self.wire_temp = 0
+        self.power = False
+        self.position = numpy.zeros(4, numpy.int64)  # machine_position
+        self.target = numpy.zeros(4, numpy.int64)  # last MOVE (absolute mode)
+        self.received = []  # raw instructions as read by loop()
+        self.steps = []  # per MOVE signed steps AX AY BX BY
+        self.pulses = []  # per MOVE pulses MA MB MC MD
+        self.increments = []  # per MOVE PathABCD increments (record_increments)
+        self.latency = []  # s from reading an instruction to its last answer
+        self.machine_time = 0.0  # s, modelled
+        self.unknown = 0  # instructions that are not part of the protocol
+        self.overflows = 0  # reads longer than raw_instruction
+        self.lost = 0  # instructions read in the buffer of a previous one
+        self.overruns = 0  # bytes lost because the receive buffer was full
+        self.t0 = None
+        self.t1 = None
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # serial ------------------------------------------------------------------
+    def _available(self, timeout):
+        if not(select.select([self.master], [], [], timeout)[0]):
+            return b''
+
+        try:
+            return os.read(self.master, 4096)
+
+        except OSError:
+            self.running = False
+            return b''
+
+    def _receive(self, pending):
+        # reads what arrived while the firmware was busy into the receive
+        # buffer, losing what does not fit
+        data = self._available(0)
+        while data:
+            pending += data
+            data = self._available(0)
+
+        if len(pending) > self.rx_size:
+            self.overruns += len(pending) - self.rx_size
+            pending = pending[:self.rx_size]
+
+        return pending
+
+    def run(self):
+        pending = b''
+        while self.running:
+            if not pending:
+                pending = self._available(0.05)
+                if not pending:
+                    continue
+
+            start = time.time()
+            if self.line_buffered:
+                pending = self._receive(pending)
+                if b'\n' not in pending:
+                    pending += self._available(0.05)
+                    continue
+
+                raw, pending = pending.split(b'\n', 1)
+
+            else:
+                # delay(10) and read everything
+                time.sleep(max(self.settings.buffer_delay*self.time_scale, 0.001))
+                raw = self._receive(pending)
+                pending = b''
+
+            self.execute(raw.decode('ascii', 'replace'), start)
+
+    # loop() ------------------------------------------------------------------
+    def execute(self, raw, start):
+        # start -> time the instruction started to be read
+        self.t0 = self.t0 or start
+        index = len(self.received)
+        self.received.append(raw)
+        if index in self.drop:
+            return
+
+        size = self.rx_size if self.line_buffered else self.settings.buffer_size
+        if len(raw) > size:
+            self.overflows += 1
+
+        if not(self.line_buffered) and raw.rstrip('\r\n').count('\n'):
+            self.lost += raw.rstrip('\r\n').count('\n')
+
+        if self.line_buffered:
+            raw = raw.rstrip('\r')
+
+        seq = None
+        if self.sequenced and raw.startswith('N'):
+            number, raw = (raw[1:].split(' ', 1) + [''])[:2]
+            seq = toInt(number)
+            if seq <= self.last_seq:
+                self.repeated += 1
+                self.reply([ACK + ' ' + str(seq)], 0.0, start)
+                return
+
+            if seq != self.last_seq + 1:
+                return
+
+            self.last_seq = seq
+
+        fields = decodeInstruction(raw, size)
+        keyword = fields[0]
+        answer = []
+        # a line buffered firmware does not wait for the buffer to fill
+        duration = 0.0 if self.line_buffered else self.settings.buffer_delay
+        if keyword == 'INIT':
+            self.initialized = True
+            answer.append(ACK)
+
+        if self.initialized:
+            answer.append(keyword)
+            if keyword == 'POWER':
+                self.power = fields[1] == 'ON'
+                answer.append(ACK)
+
+            elif keyword == 'WIRE':
+                self.wire_temp = toInt(fields[1])
+                answer.append('Wire temperature set to: ' + str(self.wire_temp))
+                answer.append(ACK)
+
+            elif keyword == 'MOVE':
+                iterations = self.move([toFloat(f) for f in fields[1:5]])
+                answer.extend([''] * iterations)
+                # the iteration output is part of iterationTime
+                duration += iterations*(self.settings.iterationTime() -
+                                        self.settings.iteration_bytes*self.settings.byteTime())
+                answer.append(ACK)
+
+            elif keyword == 'END':
+                self.initialized = False
+                answer.append(ACK)
+
+            elif keyword not in ('INIT', 'SPEED'):
+                self.unknown += 1
+
+        if seq is not None:
+            answer = [line for line in answer if line != ACK] + [ACK + ' ' + str(seq)]
+
+        self.reply(answer, duration, start)
+
+    def reply(self, answer, duration, start):
+        output = ''.join(line + '\r\n' for line in answer)
+        duration += len(output)*self.settings.byteTime()
+        self.machine_time += duration
+        remaining = duration*self.time_scale - (time.time() - start)
+        if remaining > 0:
+            time.sleep(remaining)
+
+        try:
+            os.write(self.master, output.encode('ascii'))
+
+        except OSError:
+            self.running = False
+
+        self.t1 = time.time()
+        self.latency.append(self.t1 - start)
+
+    def move(self, values):
+        # MOVE fields -> PathABCD, returns the number of iterations
+        steps = NiCrKinematics.moveSteps(numpy.array([values]), self.settings.scale)[0]
+        if self.absolute:
+            delta = steps - self.target
+            self.target = steps
+
+        else:
+            delta = steps
+
+        self.position += delta
+        self.steps.append(delta)
+        self.pulses.append(NiCrKinematics.motorPulses(delta[None, :])[0])
+        if self.record_increments:
+            self.increments.append(NiCrKinematics.pathABCD([int(d) for d in delta]))
+
+        return int(numpy.abs(delta).max())
+
+    # results -----------------------------------------------------------------
+    def stepStream(self):
+        # (N,4) signed steps AX AY BX BY of every MOVE
+        return numpy.array(self.steps, dtype=numpy.int64).reshape(-1, 4)
+
+    def summary(self):
+        # JSON friendly results of the emulated cut
+        pulses = numpy.array(self.pulses, dtype=numpy.int64).reshape(-1, 4)
+        steps = self.stepStream()
+        latency = numpy.array(self.latency) if self.latency else numpy.zeros(1)
+        wall_time = (self.t1 - self.t0) if self.t0 and self.t1 else 0.0
+        return {'instructions': len(self.received),
+                'moves': len(steps),
+                'iterations': int(numpy.abs(steps).max(axis=1).sum()) if len(steps) else 0,
+                'pulses': pulses.sum(axis=0).tolist(),
+                'position': self.position.tolist(),
+                'position_overflow': bool(len(steps)) and
+                bool(numpy.abs(numpy.cumsum(steps, axis=0)).max() > 32767),
+                'machine_time': self.machine_time,
+                'wall_time': wall_time,
+                'instructions_per_second': len(self.received)/wall_time if wall_time else 0.0,
+                'latency_mean': float(latency.mean()),
+                'latency_max': float(latency.max()),
+                'unknown': self.unknown,
+                'overflows': self.overflows,
+                'lost': self.lost,
+                'overruns': self.overruns}
+
+    def report(self):
+        data = self.summary()
+        return ('instructions: %d (%d MOVE, %d PathABCD iterations)\n'
+                % (data['instructions'], data['moves'], data['iterations']) +
+                'step pulses MA MB MC MD: %d %d %d %d\n' % tuple(data['pulses']) +
+                'machine time: %.2f s, wall time: %.2f s (%.1f instructions/s)\n'
+                % (data['machine_time'], data['wall_time'],
+                   data['instructions_per_second']) +
+                'latency: %.2f ms mean, %.2f ms max\n'
+                % (1e3*data['latency_mean'], 1e3*data['latency_max']) +
+                'unknown: %d, buffer overflows: %d, lost: %d, overrun bytes: %d\n'
+                % (data['unknown'], data['overflows'], data['lost'], data['overruns']))
+
+    def dumpJSON(self, file_name):
+        json_file = open(file_name, 'w')
+        json.dump(self.summary(), json_file, indent=1, sort_keys=True)
+        json_file.close()
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
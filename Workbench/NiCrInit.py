@@ -80,27 +80,26 @@ class CreateShapePath:
         # retrieve Selection
         selection = FreeCAD.Gui.Selection.getSelectionEx()
         for i in range(len(selection)):
-            # create WirePath folder if it does not exist
-            try:
-                WPFolder = FreeCAD.ActiveDocument.WirePath
+            NiCrPath.createShapePath(selection[i].Object)
 
-            except:
-                WPFolder = FreeCAD.ActiveDocument.addObject('App::DocumentObjectGroupPython', 'WirePath')
-                NiCrPath.WirePathFolder(WPFolder)
-                NiCrPath.WirePathViewProvider(WPFolder)
 
-            # create shapepath object
-            selObj = selection[i].Object
-            shapepath_name = 'ShapePath_' + selObj.Name
-            shapepathobj = FreeCAD.ActiveDocument.addObject('Part::FeaturePython', shapepath_name)
-            # initialize python object
-            NiCrPath.ShapePath(shapepathobj, selObj)
-            NiCrPath.ShapePathViewProvider(shapepathobj.ViewObject)
-            # modify color
-            shapepathobj.ViewObject.ShapeColor = (1.0, 1.0, 1.0)
-            shapepathobj.ViewObject.LineWidth = 1.0
-            WPFolder.addObject(shapepathobj)
+class BatchRoute:
+    def GetResources(self):
+        return {'Pixmap': __dir__ + '/icons/ShapePath.svg',
+                'MenuText': 'Batch Route',
+                'ToolTip': 'Create the wirepaths of all the selected objects, one after another'}
+
+    def IsActive(self):
+        try:
+            a = FreeCAD.ActiveDocument.NiCrMachine
+            return True
+
+        except:
+            return False
 
+    def Activated(self):
+        selection = FreeCAD.Gui.Selection.getSelectionEx()
+        NiCrPath.batchCreateShapePaths([sel.Object for sel in selection])
 
 
 class CreatePathLink:
@@ -152,23 +151,26 @@ class CreatePathLink:
 
         if len(selection) == 2:
             # Create link between paths if len(selection) = 2
-            selA = selection[0]
-            selB = selection[1]
-            SelObjA = selA.Object
-            SelObjB = selA.Object
-            # Link object
-            link_name = 'Link_' + SelObjA.Name[8:] + '_' + SelObjB.Name[8:]
-            LinkObj = FreeCAD.ActiveDocument.addObject('Part::FeaturePython', link_name)
-            # initialize link object
-            NiCrPath.LinkPath(LinkObj, selA, selB)
-            NiCrPath.LinkPathViewProvider(LinkObj.ViewObject)
-            # link representation
-            # LinkObj.ViewObject.ShapeColor = (1.0, 0.0, 0.0)
-            LinkObj.ViewObject.Transparency = 15
-            # LinkObj.ViewObject.LineColor = (1.0, 0.0, 0.0)
-            LinkObj.ViewObject.DisplayMode = "Shaded"
-            # add to folder
-            FreeCAD.ActiveDocument.WirePath.addObject(LinkObj)
+            NiCrPath.createLinkPath(NiCrPath.selectionEnd(selection[0]),
+                                    NiCrPath.selectionEnd(selection[1]))
+
+
+class AutoRoute:
+    def GetResources(self):
+        return {'Pixmap': __dir__ + '/icons/PathLink.svg',
+                'MenuText': 'Auto Route',
+                'ToolTip': 'Replace the links by the shortest links between all paths'}
+
+    def IsActive(self):
+        try:
+            a = FreeCAD.ActiveDocument.InitialPath
+            return True
+
+        except:
+            return False
+
+    def Activated(self):
+        NiCrPath.autoRoute()
 
 
 class SaveWirePath:
@@ -220,11 +222,31 @@ class RunPathSimulation:
         FreeCAD.Console.PrintMessage('Simulation finished\n')
 
 
+class EstimateCutTime:
+    def GetResources(self):
+        return {'Pixmap': __dir__ + '/icons/AnimateMachine.svg',
+                'MenuText': 'Estimate Cut Time',
+                'ToolTip': 'Estimate steps and cut time of the current toolpath'}
+
+    def IsActive(self):
+        try:
+            a = FreeCAD.ActiveDocument.FinalPath
+            return True
+        except:
+            return False
+
+    def Activated(self):
+        full_path = NiCrPath.CreateExportPath()
+        NiCrSM.estimateCutTime(full_path)
+
 
 if FreeCAD.GuiUp:
     FreeCAD.Gui.addCommand('CreateNiCrMachine', CreateNiCrMachine())
     FreeCAD.Gui.addCommand('CreateToolPath', CreateShapePath())
+    FreeCAD.Gui.addCommand('BatchRoute', BatchRoute())
     FreeCAD.Gui.addCommand('CreatePathLink', CreatePathLink())
+    FreeCAD.Gui.addCommand('AutoRoute', AutoRoute())
     FreeCAD.Gui.addCommand('SaveWirePath', SaveWirePath())
     FreeCAD.Gui.addCommand('ImportWirePath', ImportWirePath())
     FreeCAD.Gui.addCommand('RunPathSimulation', RunPathSimulation())
+    FreeCAD.Gui.addCommand('EstimateCutTime', EstimateCutTime())
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+# NiCr (Hot Wire CNC Cutter) workbench for FreeCAD
+# (c) 2016 Javier Martínez García
+#***************************************************************************
+#*   (c) Javier Martínez García 2016                                       *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License (GPL)            *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Lesser General Public License for more details.                   *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with FreeCAD; if not, write to the Free Software        *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************/
+
+import numpy
+import NiCrCore
+
+# Headless model of the machine firmware (Firmware/NiCrFW.ino) that estimates
+# steps and cut time of a program without sending it to the machine.
+# The firmware receives MOVE AX AY BX BY (mm), scales every field to steps
+# (scaleMA..scaleMD) and PathABCD iterates over the longest of the 4 travels:
+# every iteration advances each axis -1, 0 or 1 steps and calls MoveStepper,
+# which mixes them into the coreXY motors (MA = ax+ay, MB = ax-ay, MC = bx+by,
+# MD = bx-by) and gives two step pulses (high + low delay each, the second
+# one only for motors that move 2 steps).
+# MOVE values are absolute positions (as the workbench exports them, and the
+# convention of NiCrSender and NiCrEmulator), so every segment moves from the
+# previous MOVE to the current one, starting at machine zero. NiCrFW.ino as
+# written adds them to its position as relative steps instead.
+
+
+class FirmwareSettings:
+    # firmware constants, defaults from NiCrFW.ino
+    def __init__(self, scale=(2.0, 2.0, 2.0, 2.0), high_delay=10.0,
+                 low_delay=10.0, baudrate=115200, buffer_delay=0.010,
+                 buffer_size=25, iteration_bytes=2, reply_bytes=12):
+        self.scale = numpy.array(scale, dtype=float)  # steps/mm AX AY BX BY
+        self.high_delay = high_delay  # us, variable_high_delay
+        self.low_delay = low_delay  # us, variable_low_delay
+        self.baudrate = baudrate
+        self.buffer_delay = buffer_delay  # s, delay(10) before reading serial
+        self.buffer_size = buffer_size  # chars of raw_instruction
+        self.iteration_bytes = iteration_bytes  # Serial.println() per iteration
+        self.reply_bytes = reply_bytes  # echoed instruction name + DONE
+
+    def byteTime(self):
+        # s per serial byte (8N1 -> 10 bits)
+        return 10.0 / self.baudrate
+
+    def iterationTime(self):
+        # s per PathABCD iteration: two pulses, limited by the serial output
+        pulses = 2*(self.high_delay + self.low_delay)*1e-6
+        return max(pulses, self.iteration_bytes*self.byteTime())
+
+
+def roundAway(x):
+    # arduino round(): half away from zero
+    return numpy.copysign(numpy.floor(numpy.abs(x) + 0.5), x)
+
+
+def moveSteps(moves, scale):
+    # (N,4) mm -> (N,4) int64 absolute steps, scaled in float32 as the firmware
+    scaled = moves.astype(numpy.float32) * numpy.asarray(scale, dtype=numpy.float32)
+    return roundAway(scaled).astype(numpy.int64)
+
+
+def pathABCD(delta):
+    # reference (per step) implementation of the firmware PathABCD. Returns
+    # the list of [ax, ay, bx, by] increments given to MoveStepper
+    aux = max(abs(d) for d in delta)
+    R = [numpy.float32(d) / numpy.float32(aux) for d in delta] if aux else []
+    acc = [0, 0, 0, 0]
+    increments = []
+    for j in range(1, aux + 1):
+        inc = [int(roundAway(R[i]*numpy.float32(j) - numpy.float32(acc[i])))
+               for i in range(4)]
+        acc = [acc[i] + inc[i] for i in range(4)]
+        increments.append(inc)
+
+    return increments
+
+
+def motorPulses(deltas, chunk_size=2000000):
+    # (N,4) per segment step deltas -> (N,4) step pulses of motors MA..MD.
+    # When only one axis of a side moves, both motors of the side get
+    # |dx| + |dy| pulses. Otherwise the pulses depend on which iterations step
+    # both axes at once (they add up in one motor and cancel in the other), so
+    # those segments expand their PathABCD iterations (chunk_size at a time)
+    deltas = numpy.asarray(deltas, dtype=numpy.int64).reshape(-1, 4)
+    mix = numpy.abs(deltas)
+    pulses = numpy.empty_like(mix)
+    pulses[:, 0] = mix[:, 0] + mix[:, 1]
+    pulses[:, 1] = pulses[:, 0]
+    pulses[:, 2] = mix[:, 2] + mix[:, 3]
+    pulses[:, 3] = pulses[:, 2]
+    aux = mix.max(axis=1)
+    opposed = ((deltas[:, 0]*deltas[:, 1] != 0) |
+               (deltas[:, 2]*deltas[:, 3] != 0))
+    segments = numpy.nonzero(opposed)[0]
+    if len(segments) == 0:
+        return pulses
+
+    R = (deltas[segments].astype(numpy.float32) /
+         aux[segments, None].astype(numpy.float32))
+    ends = numpy.cumsum(aux[segments])
+    first = 0
+    while first < len(segments):
+        last = numpy.searchsorted(ends, ends[first] - aux[segments[first]] +
+                                  chunk_size, side='right')
+        last = max(last, first + 1)
+        counts = aux[segments[first:last]]
+        owner = numpy.repeat(numpy.arange(last - first), counts)
+        starts = numpy.cumsum(counts) - counts
+        j = (numpy.arange(len(owner)) - starts[owner] + 1).astype(numpy.float32)
+        r = R[first:last][owner]
+        # acc after iteration j is round(R*j), the increments are differences
+        inc = roundAway(r*j[:, None]) - roundAway(r*(j[:, None] - 1))
+        motors = numpy.abs(numpy.column_stack((inc[:, 0] + inc[:, 1],
+                                               inc[:, 0] - inc[:, 1],
+                                               inc[:, 2] + inc[:, 3],
+                                               inc[:, 2] - inc[:, 3])))
+        for m in range(4):
+            pulses[segments[first:last], m] = numpy.bincount(
+                owner, weights=motors[:, m], minlength=last - first)
+
+        first = last
+
+    return pulses
+
+
+def bresenhamSteps(block):
+    # motor steps MA MB MC MD of one step block (NiCrCore.stepBlocks) ->
+    # (events,4) steps (-1, 0, 1) of every Bresenham event. With E events
+    # (the longest motor travel) and the error starting at E//2, motor m
+    # steps on event k when (k*|Dm| + E//2) // E increases
+    block = numpy.asarray(block, dtype=numpy.int64)
+    events = int(numpy.abs(block).max()) if len(block) else 0
+    k = numpy.arange(events + 1)[:, None]
+    counts = (k*numpy.abs(block) + events // 2) // max(events, 1)
+    return (numpy.diff(counts, axis=0)*numpy.sign(block)).astype(numpy.int8)
+
+
+def blockEvents(blocks):
+    # (N,) Bresenham events of every step block
+    blocks = numpy.asarray(blocks, dtype=numpy.int64).reshape(-1, 4)
+    return numpy.abs(blocks).max(axis=1)
+
+
+def planningReport(moves, scale, settings=None):
+    # PathABCD (firmware) vs host planned step blocks for moves (N,4) mm:
+    # step events and stepping time, one pulse per event in the blocks
+    settings = settings or FirmwareSettings(scale)
+    blocks, table = NiCrCore.stepBlocks(moves, [], scale)
+    events = int(blockEvents(blocks).sum())
+    pulse = (settings.high_delay + settings.low_delay)*1e-6
+    result = simulateMoves(moves, settings)
+    iterations = int(result.iterations.sum())
+    return ('step blocks: %d (%d bytes)\n' % (len(blocks), 8*len(blocks)) +
+            'PathABCD: %d iterations, %.2f s stepping\n'
+            % (iterations, iterations*settings.iterationTime()) +
+            'Bresenham: %d events, %.2f s stepping\n' % (events, events*pulse))
+
+
+def lineLengths(moves):
+    # characters of the '%.3f' MOVE lines of moves (N,4), without line break
+    a = numpy.round(numpy.abs(moves), 3)
+    digits = numpy.floor(numpy.log10(numpy.maximum(a, 1.0))) + 1
+    # negative values keep the sign, even when they print as -0.000
+    widths = digits + 4 + numpy.signbit(moves)
+    return (4 + 4 + widths.sum(axis=1)).astype(numpy.int64)
+
+
+class KinematicResult:
+    # output of simulateMoves. Per segment arrays (one row per MOVE):
+    #   steps       (N,4) signed steps of AX AY BX BY
+    #   pulses      (N,4) step pulses of motors MA MB MC MD
+    #   iterations  (N,)  PathABCD iterations
+    #   time        (N,)  s, stepping plus the serial exchange of the MOVE
+    def __init__(self, moves, steps, pulses, iterations, time, settings,
+                 extra_time=0.0, long_lines=0):
+        self.moves = moves
+        self.steps = steps
+        self.pulses = pulses
+        self.iterations = iterations
+        self.time = time
+        self.settings = settings
+        self.extra_time = extra_time  # s, non MOVE instructions
+        self.long_lines = long_lines  # MOVE lines over the firmware buffer
+
+    def __len__(self):
+        return len(self.steps)
+
+    def totalPulses(self):
+        return self.pulses.sum(axis=0)
+
+    def cutTime(self):
+        return float(self.time.sum()) + self.extra_time
+
+    def peakPulseRates(self):
+        # (4,) highest pulses/s of every motor along a single segment
+        rates = self.pulses / numpy.maximum(self.time, 1e-12)[:, None]
+        return rates.max(axis=0) if len(rates) else numpy.zeros(4)
+
+    def peakFeedRates(self):
+        # (4,) highest mm/s of the AX AY BX BY axes along a single segment
+        travel = numpy.abs(self.steps) / self.settings.scale
+        rates = travel / numpy.maximum(self.time, 1e-12)[:, None]
+        return rates.max(axis=0) if len(rates) else numpy.zeros(4)
+
+    def positionOverflow(self):
+        # the firmware keeps machine_position in 16 bit ints
+        absolute = numpy.cumsum(self.steps, axis=0)
+        return bool(len(absolute)) and bool(numpy.abs(absolute).max() > 32767)
+
+    def report(self):
+        seconds = self.cutTime()
+        lines = ['moves: %d' % len(self),
+                 'PathABCD iterations: %d' % int(self.iterations.sum()),
+                 'step pulses MA MB MC MD: %d %d %d %d' % tuple(self.totalPulses()),
+                 'peak pulse rate MA MB MC MD (1/s): %.0f %.0f %.0f %.0f'
+                 % tuple(self.peakPulseRates()),
+                 'peak feed AX AY BX BY (mm/s): %.2f %.2f %.2f %.2f'
+                 % tuple(self.peakFeedRates()),
+                 'estimated cut time: %d:%02d:%04.1f (%.1f s)'
+                 % (seconds // 3600, (seconds % 3600) // 60, seconds % 60, seconds)]
+        if self.long_lines:
+            lines.append('WARNING: %d MOVE lines longer than the %d char '
+                         'firmware buffer' % (self.long_lines,
+                                              self.settings.buffer_size))
+
+        if self.positionOverflow():
+            lines.append('WARNING: machine position exceeds the 16 bit '
+                         'firmware step counter')
+
+        return '\n'.join(lines) + '\n'
+
+
+def simulateMoves(moves, settings=None, n_instructions=0):
+    # moves -> (N,4) AX AY BX BY mm as sent to the machine. n_instructions is
+    # the number of non MOVE instructions of the program (serial exchange only)
+    settings = settings or FirmwareSettings()
+    moves = numpy.asarray(moves, dtype=float).reshape(-1, 4)
+    absolute = moveSteps(moves, settings.scale)
+    steps = numpy.diff(absolute, axis=0, prepend=numpy.zeros((1, 4), numpy.int64))
+    iterations = numpy.abs(steps).max(axis=1) if len(steps) else numpy.zeros(0, numpy.int64)
+    pulses = motorPulses(steps)
+    line_chars = lineLengths(moves)
+    exchange = (settings.buffer_delay +
+                (line_chars + 1 + settings.reply_bytes)*settings.byteTime())
+    time = iterations*settings.iterationTime() + exchange
+    extra_time = n_instructions*(settings.buffer_delay +
+                                 (10 + settings.reply_bytes)*settings.byteTime())
+    long_lines = int((line_chars >= settings.buffer_size).sum())
+    return KinematicResult(moves, steps, pulses, iterations, time, settings,
+                           extra_time, long_lines)
+
+
+def simulateRoute(route, zero_point=(0.0, 0.0, 0.0), settings=None, planes=None):
+    # complete raw path (side_A, side_B, commands) -> KinematicResult of the
+    # program writeNiCrProgram would export. With planes=(Z0, Z1) the wire is
+    # first projected to the machine frame planes (as runSimulation does)
+    path = NiCrCore.WirePath.fromRoute(route)
+    return simulateMoves(NiCrCore.programMoves(path, zero_point, planes),
+                         settings, len(NiCrCore.programTable(path)))
+
+
+def simulateNiCrFile(file_name, settings=None):
+    # .nicr or .nicrb program -> KinematicResult
+    if file_name.endswith('.nicrb'):
+        program = NiCrCore.NiCrBinaryProgram(file_name)
+        try:
+            moves = program.coordinates()
+            n_instructions = len(program.table)
+
+        finally:
+            program.close()
+
+        return simulateMoves(moves, settings, n_instructions)
+
+    moves = []
+    n_instructions = 0
+    nicr_file = open(file_name, 'r')
+    try:
+        for record in NiCrCore.parseNiCrProgram(nicr_file):
+            if record.kind == 'MOVE':
+                moves.append(record.args)
+
+            elif record.kind != 'HEADER':
+                n_instructions += 1
+
+    finally:
+        nicr_file.close()
+
+    return simulateMoves(numpy.array(moves, dtype=float), settings, n_instructions)
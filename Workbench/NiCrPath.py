@@ -23,11 +23,23 @@
 #***************************************************************************/
 
 
+import hashlib
+import os
+import time
+import numpy
 import FreeCAD
 import FreeCADGui
 import Part
-import time
-from PySide import QtGui
+import NiCrCore
+import NiCrKinematics
+import NiCrProfile
+import NiCrSimMachine
+from PySide import QtCore, QtGui
+
+
+# property type (addProperty attr) Prop_NoRecompute: changes do not touch
+# (recompute) the owner object, onChanged redraws it instead
+PROP_NORECOMPUTE = 16
 
 
 class WirePathFolder:
@@ -40,8 +52,57 @@ class WirePathFolder:
         obj.addProperty('App::PropertyFloat', 'setWireTemp', 'PathSettings')
         obj.addProperty('App::PropertyEnumeration', 'TrajectoryColor', 'View')
         obj.TrajectoryColor = ['Speed', 'Temperature']
+        obj.addProperty('App::PropertyEnumeration', 'PathRepresentation', 'View',
+                        'Shape used to draw the wire paths (Loft is the slowest)')
+        obj.PathRepresentation = PATH_REPRESENTATIONS
+        obj.addProperty('App::PropertyBool', 'ExportFramePlanes', 'Export',
+                        'Export the wire projected to the machine frame planes '
+                        'instead of the part points')
+        obj.addProperty('App::PropertyFloat', 'LinkTolerance', 'PathSettings',
+                        'Max distance (mm) a link anchor can move when a path is '
+                        'regenerated before the link is removed').LinkTolerance = 1.0
+        obj.addProperty('App::PropertyFloat', 'SimplifyTolerance', 'Export',
+                        'Max deviation (mm) of the points removed from the '
+                        'exported path (0 = export every point)')
+        obj.addProperty('App::PropertyBool', 'FeedPlanner', 'Export',
+                        'Slow the path down at the corners with per segment '
+                        'speeds (never above the path speeds nor MaxCutSpeed)')
+        obj.addProperty('App::PropertyFloat', 'MaxAcceleration', 'Machine Limits',
+                        'Acceleration used by the feed planner (mm/s^2)'
+                        ).MaxAcceleration = 100.0
+        obj.addProperty('App::PropertyFloat', 'JunctionDeviation', 'Machine Limits',
+                        'Corner tolerance of the feed planner (mm), higher '
+                        'values take the corners faster').JunctionDeviation = 0.05
+        obj.addProperty('App::PropertyBool', 'SyncSides', 'Export',
+                        'Export the speed of every segment so the faster wire '
+                        'side moves at the path speed (tapered cuts)')
+        obj.addProperty('App::PropertyFloat', 'DwellRatio', 'Export',
+                        'Segments whose short side travels less than this '
+                        'fraction of the long side are reported as dwell '
+                        'risk').DwellRatio = 0.5
+        obj.addProperty('App::PropertyBool', 'StepBlocks', 'Export',
+                        'Store .nicrb programs as coreXY motor step blocks '
+                        'planned on the host (see NiCrCore.stepBlocks)')
+        obj.addProperty('App::PropertyFloatList', 'StepScale', 'Export',
+                        'Steps/mm of the AX AY BX BY axes used by the step '
+                        'blocks (scaleMA..scaleMD of the firmware)')
+        obj.StepScale = [2.0, 2.0, 2.0, 2.0]
+        obj.addProperty('App::PropertyBool', 'Profile', 'Export',
+                        'Print the time of every pipeline stage when the path '
+                        'is exported (see NiCrProfile)')
         obj.Proxy = self
 
+    def onChanged(self, fp, prop):
+        if prop == 'PathRepresentation' and 'Restore' not in getattr(fp, 'State', []):
+            # redraw the paths without regenerating them (imported paths
+            # are not part of the folder); links are drawn on recompute
+            for obj in FreeCAD.ActiveDocument.Objects:
+                if getattr(obj, 'RawPath', None):
+                    obj.Shape = displayShape(obj)
+
+                elif obj in fp.Group:
+                    obj.touch()
+
     def execute(self, fp):
         for obj in FreeCAD.ActiveDocument.Objects:
             try:
@@ -68,8 +129,12 @@ class WirePathViewProvider:
         return __dir__ + '/icons/WirePath.svg'
 
 
+# default path settings of new ShapePaths (also used by batch routing)
+SHAPEPATH_DEFAULTS = {'PointDensity': 6.0, 'ChordTolerance': 0.0, 'Reverse': False}
+
+
 class ShapePath:
-    def __init__(self, obj, selObj):
+    def __init__(self, obj, selObj, raw_path=None):
         obj.addProperty('App::PropertyString',
                         'ShapeName',
                         'Path Data').ShapeName = selObj.Name
@@ -89,40 +154,83 @@ class ShapePath:
         obj.addProperty('App::PropertyFloat',
                         'PointDensity',
                         'Path Settings',
-                        'Path density in mm/point').PointDensity = 6.0
+                        'Path density in mm/point').PointDensity = SHAPEPATH_DEFAULTS['PointDensity']
+
+        obj.addProperty('App::PropertyFloat',
+                        'ChordTolerance',
+                        'Path Settings',
+                        'Max chord error (mm) of curved edges, sampled adaptively '
+                        '(0 = use PointDensity)').ChordTolerance = SHAPEPATH_DEFAULTS['ChordTolerance']
 
         obj.addProperty('App::PropertyBool',
                         'Reverse',
                         'Path Settings',
-                        'Reverses the cut direction of this path').Reverse = False
+                        'Reverses the cut direction of this path').Reverse = SHAPEPATH_DEFAULTS['Reverse']
 
         obj.addProperty('App::PropertyBool',
                         'ShowMachinePath',
                         'Visualization',
                         'Shows the path projected to the machine sides')
 
+        obj.addProperty('App::PropertyFloat',
+                        'DisplayTolerance',
+                        'Visualization',
+                        'Max deviation (mm) of the displayed path (0 = full resolution)',
+                        PROP_NORECOMPUTE).DisplayTolerance = 0.0
+
         obj.Proxy = self
         shape = FreeCAD.ActiveDocument.getObject(obj.ShapeName)
-        obj.RawPath = ShapeToNiCrPath(shape, obj.PointDensity, reverse=obj.Reverse)
-        obj.Shape = PathToShape(obj.RawPath)
+        if raw_path is None:
+            # raw_path can be computed in advance (batch routing)
+            raw_path = ShapeToNiCrPath(shape, obj.PointDensity, reverse=obj.Reverse,
+                                       tolerance=obj.ChordTolerance)
+
+        obj.RawPath = raw_path
+        invalidatePointIndex(obj)
+        obj.Shape = displayShape(obj)
+        _route_cache.put(routeKey(obj), [raw_path, displayKey(obj), obj.Shape.copy()])
         # hide original shape
         FreeCAD.ActiveDocument.getObject(obj.ShapeName).ViewObject.Visibility = False
 
     def execute(self, fp):
-        shape = FreeCAD.ActiveDocument.getObject(fp.ShapeName)
-        fp.RawPath = ShapeToNiCrPath(shape, fp.PointDensity, reverse=fp.Reverse)
-        fp.Shape = PathToShape(fp.RawPath)
-        # remove child and parent link objects (they need to be re-defined)
-        for obj in FreeCAD.ActiveDocument.Objects:
-            try:
-                if obj.PathNameA == fp.Name:
-                    FreeCAD.ActiveDocument.removeObject(obj.Name)
+        # the route is reused while the source shape and the path settings
+        # do not change (see routeKey)
+        key = routeKey(fp)
+        entry = _route_cache.get(key)
+        if NiCrProfile.enabled():
+            NiCrProfile.count('route cache ' + ('miss' if entry is None else 'hit'))
+            FreeCAD.Console.PrintMessage(fp.Label + ': path cache ' +
+                                         ('miss' if entry is None else 'hit') + ' (' +
+                                         str(_route_cache.hits) + ' hits, ' +
+                                         str(_route_cache.misses) + ' misses)\n')
+        if entry is None:
+            shape = FreeCAD.ActiveDocument.getObject(fp.ShapeName)
+            raw_path = ShapeToNiCrPath(shape, fp.PointDensity, reverse=fp.Reverse,
+                                       tolerance=getattr(fp, 'ChordTolerance', 0.0))
+            entry = [raw_path, None, None]
+            _route_cache.put(key, entry)
+
+        if not(samePath(fp.RawPath, entry[0])):
+            old_raw_path = fp.RawPath
+            fp.RawPath = entry[0]
+            invalidatePointIndex(fp)
+            entry[1] = None
+            # move the links to the new path points
+            relinkPath(fp, old_raw_path)
+
+        if entry[1] != displayKey(fp):
+            fp.Shape = displayShape(fp)
+            entry[1] = displayKey(fp)
+            entry[2] = fp.Shape.copy()
 
-                if obj.PathNameB == fp.Name:
-                    FreeCAD.ActiveDocument.removeObject(obj.Name)
+        else:
+            fp.Shape = entry[2].copy()
 
-            except AttributeError:
-                pass
+    def onChanged(self, fp, prop):
+        if (prop == 'DisplayTolerance' and fp.RawPath and
+                'Restore' not in getattr(fp, 'State', [])):
+            # only the representation changes, the path is not regenerated
+            fp.Shape = displayShape(fp)
 
 
 class ShapePathViewProvider:
@@ -136,24 +244,42 @@ class ShapePathViewProvider:
 
 
 class LinkPath:
-    def __init__(self, obj, selA, selB):
+    def __init__(self, obj, endA, endB, auto=False):
+        # endA, endB -> (shapepath, point index, anchor position), see
+        # selectionEnd and pathPointEnd. auto -> created by autoRoute
         obj.addProperty('App::PropertyString',
                         'PathNameA',
-                        'Link Data').PathNameA = selA.Object.Name
+                        'Link Data').PathNameA = endA[0].Name
 
         obj.addProperty('App::PropertyString',
                         'PathNameB',
-                        'Link Data').PathNameB = selB.Object.Name
+                        'Link Data').PathNameB = endB[0].Name
 
         obj.addProperty('App::PropertyInteger',
                         'PathIndexA',
-                        'Link Data').PathIndexA = pointFromPath(selA.SubObjects[0].Point,
-                                                                selA.Object.RawPath)
+                        'Link Data').PathIndexA = endA[1]
+
+        obj.addProperty('App::PropertyVector',
+                        'AnchorA',
+                        'Link Data',
+                        'Selected position, the link follows it when the path is regenerated'
+                        ).AnchorA = endA[2]
 
         obj.addProperty('App::PropertyInteger',
                         'PathIndexB',
-                        'Link Data').PathIndexB = pointFromPath(selB.SubObjects[0].Point,
-                                                                selB.Object.RawPath)
+                        'Link Data').PathIndexB = endB[1]
+
+        obj.addProperty('App::PropertyVector',
+                        'AnchorB',
+                        'Link Data',
+                        'Selected position, the link follows it when the path is regenerated'
+                        ).AnchorB = endB[2]
+
+        obj.addProperty('App::PropertyBool',
+                        'AutoRouted',
+                        'Link Data',
+                        'Created by Auto route, which replaces it when run again'
+                        ).AutoRouted = auto
 
         obj.addProperty('App::PropertyFloat',
                         'CutSpeed',
@@ -236,7 +362,13 @@ class InitialPath:
         obj.addProperty('App::PropertyInteger',
                         'PathIndex',
                         'Link Data').PathIndex = pointFromPath(selObj.SubObjects[0].Point,
-                                                               selObj.Object.RawPath)
+                                                               selObj.Object)
+
+        obj.addProperty('App::PropertyVector',
+                        'Anchor',
+                        'Link Data',
+                        'Selected position, the link follows it when the path is regenerated'
+                        ).Anchor = selObj.SubObjects[0].Point
 
         obj.addProperty('App::PropertyFloat',
                         'CutSpeed',
@@ -312,7 +444,13 @@ class FinalPath:
         obj.addProperty('App::PropertyInteger',
                         'PathIndex',
                         'Link Data').PathIndex = pointFromPath(selObj.SubObjects[0].Point,
-                                                               selObj.Object.RawPath)
+                                                               selObj.Object)
+
+        obj.addProperty('App::PropertyVector',
+                        'Anchor',
+                        'Link Data',
+                        'Selected position, the link follows it when the path is regenerated'
+                        ).Anchor = selObj.SubObjects[0].Point
 
         obj.addProperty('App::PropertyFloat',
                         'CutSpeed',
@@ -387,7 +525,63 @@ class FinalPathViewProvider:
         obj.Proxy = self
 
 
+class ImportedPath:
+    # path read from a .nicr/.nicrb file. RawPath keeps the full resolution
+    # route (points and commands), the 3D view shows a reduced version
+    def __init__(self, obj, complete_path):
+        obj.addProperty('App::PropertyPythonObject',
+                        'RawPath',
+                        'Path Data')
+
+        obj.addProperty('App::PropertyFloat',
+                        'DisplayTolerance',
+                        'Visualization',
+                        'Max deviation (mm) of the displayed path (0 = full resolution)',
+                        PROP_NORECOMPUTE).DisplayTolerance = 0.1
+
+        obj.Proxy = self
+        obj.RawPath = complete_path
+        obj.Shape = displayShape(obj)
+
+    def execute(self, fp):
+        fp.Shape = displayShape(fp)
+
+    def onChanged(self, fp, prop):
+        if (prop == 'DisplayTolerance' and fp.RawPath and
+                'Restore' not in getattr(fp, 'State', [])):
+            fp.Shape = displayShape(fp)
+
+
+class ImportedPathViewProvider:
+    def __init__(self, obj):
+        obj.Proxy = self
+
+    def getIcon(self):
+        import os
+        __dir__ = os.path.dirname(__file__)
+        return __dir__ + '/icons/LoadPath.svg'
+
+
 # NiCrPath Functions ----------------------------------------------------------
+def linkGraph():
+    # Maps every point where a link leaves a shapepath to the links that start
+    # there: (PathNameA, PathIndexA) -> [LinkPath, ...] in document order.
+    # Built in a single pass so the route builder does not have to scan the
+    # whole document for every point of every shapepath.
+    link_graph = {}
+    for obj in FreeCAD.ActiveDocument.Objects:
+        try:
+            key = (obj.PathNameA, obj.PathIndexA)
+
+        except AttributeError:
+            continue
+
+        link_graph.setdefault(key, []).append(obj)
+
+    return link_graph
+
+
+@NiCrProfile.timed('CreateCompleteRawPath')
 def CreateCompleteRawPath():
     # recursive link-explorer function
     def exploreLink(lobj):
@@ -407,30 +601,28 @@ def CreateCompleteRawPath():
         # destination path temperature and speed commands
         route_commands.append([len(pr_A)-1, destPath.CutSpeed, destPath.WireTemperature])
         # append partial shapepath
+        raw_path = destPath.RawPath
         trigger = False
-        for i in range(len(destPath.RawPath[0])+1):
+        for i in range(len(raw_path[0])+1):
             if not(trigger):
                 n = i + lobj.PathIndexB
 
-            if n == len(destPath.RawPath[0]) or trigger:
-                n = i + lobj.PathIndexB - len(destPath.RawPath[0])
+            if n == len(raw_path[0]) or trigger:
+                n = i + lobj.PathIndexB - len(raw_path[0])
                 trigger = True
 
             # look for link that derivates from this path
             if i > 0:
-                for obj in FreeCAD.ActiveDocument.Objects:
-                    try:
-                        if obj.PathIndexA == n and obj.PathNameA == destPath.Name:
-                            pr_A.append(destPath.RawPath[0][n])
-                            pr_B.append(destPath.RawPath[1][n])
-                            exploreLink(obj)
-                    except:
-                        pass
-
-            pr_A.append(destPath.RawPath[0][n])
-            pr_B.append(destPath.RawPath[1][n])
+                for obj in link_graph.get((destPath.Name, n), ()):
+                    pr_A.append(raw_path[0][n])
+                    pr_B.append(raw_path[1][n])
+                    exploreLink(obj)
+
+            pr_A.append(raw_path[0][n])
+            pr_B.append(raw_path[1][n])
 
     # init of the routing script--------------------------------------------
+    link_graph = linkGraph()
     pr_A = []  # partial route A
     pr_B = []  # partial route B
     route_commands = [] # stores commands issued along the route(speed, temp..)
@@ -447,28 +639,25 @@ def CreateCompleteRawPath():
 
     firstSP = FreeCAD.ActiveDocument.getObject(iphobj.PathName)
     route_commands.append([len(pr_A)-1, firstSP.CutSpeed, firstSP.WireTemperature])
+    raw_path = firstSP.RawPath
     trigger = False
-    for i in range(len(firstSP.RawPath[0])+1):
+    for i in range(len(raw_path[0])+1):
         if not(trigger):
             n = i + iphobj.PathIndex
 
-        if n == len(firstSP.RawPath[0]) or trigger:
-            n = i + iphobj.PathIndex - len(firstSP.RawPath[0])
+        if n == len(raw_path[0]) or trigger:
+            n = i + iphobj.PathIndex - len(raw_path[0])
             trigger = True
 
         # look for any link that derivates from this path
         if i > 0:
-            for obj in FreeCAD.ActiveDocument.Objects:
-                try:
-                    if obj.PathIndexA == n and obj.PathNameA == firstSP.Name:
-                        pr_A.append(firstSP.RawPath[0][n])
-                        pr_B.append(firstSP.RawPath[1][n])
-                        exploreLink(obj)
-                except:
-                    pass
+            for obj in link_graph.get((firstSP.Name, n), ()):
+                pr_A.append(raw_path[0][n])
+                pr_B.append(raw_path[1][n])
+                exploreLink(obj)
 
-        pr_A.append(firstSP.RawPath[0][n])
-        pr_B.append(firstSP.RawPath[1][n])
+        pr_A.append(raw_path[0][n])
+        pr_B.append(raw_path[1][n])
 
     # initial path speed and temperature commands
     route_commands.append([len(pr_A)-1, iphobj.CutSpeed, iphobj.WireTemperature])
@@ -481,199 +670,490 @@ def CreateCompleteRawPath():
             pr_B.append((aux_p.x, aux_p.y, FreeCAD.ActiveDocument.NiCrMachine.ZLength))
 
     # clean geometry
-    cl_A = []
-    cl_B = []
-    pr_A.append(pr_A[0])
-    pr_B.append(pr_B[0])
-    for i in range(len(pr_A)-1):
-        Av0 = pr_A[i]
-        Av1 = pr_A[i+1]
-        append = True
-        if Av0[0] == Av1[0] and Av0[1] == Av1[1] and Av0[2] == Av1[2]:
-            append = False
-            # re-arrange commands (the have to be displaced as we are removing
-            # points from the route)
-            for cmd in route_commands:
-                if cmd[0] > i:
-                    cmd[0] -= 1
-
-        if append:
-            cl_A.append(pr_A[i])
-            cl_B.append(pr_B[i])
-
-    complete_raw_path = (cl_A, cl_B, route_commands)
+    complete_raw_path = NiCrCore.removeDuplicatePoints((pr_A, pr_B, route_commands))
+    NiCrProfile.count('exported points', len(complete_raw_path[0]))
     return complete_raw_path
 
 
-def ShapeToNiCrPath(selected_object, precision, reverse=False):
-    # Creates the wire path for an input shape. Returns a list of points with
-    # a structure: trajectory_list[machine_side][xyz]
+def linkAnchorPoints():
+    # side A points where links, initial and final paths join the shape paths,
+    # plus their control points
+    points = []
+    for obj in FreeCAD.ActiveDocument.Objects:
+        for name, index in (('PathNameA', 'PathIndexA'), ('PathNameB', 'PathIndexB'),
+                            ('PathName', 'PathIndex')):
+            try:
+                path = FreeCAD.ActiveDocument.getObject(getattr(obj, name))
+                points.append(path.RawPath[0][getattr(obj, index)])
+
+            except (AttributeError, IndexError, TypeError):
+                pass
+
+        for i in range(5):
+            try:
+                aux_p = obj.getPropertyByName('ControlPoint' + str(i))
+
+            except AttributeError:
+                break
+
+            if (aux_p.x > 0 or aux_p.y > 0) and aux_p.z == 0:
+                points.append((aux_p.x, aux_p.y, 0))
+
+    return points
+
+
+def CreateExportPath():
+    # complete raw path with the export stages of the WirePath folder applied:
+    # simplification (SimplifyTolerance), feed planning (FeedPlanner) and side
+    # speed synchronization (SyncSides)
+    export_path = simplifyExportPath(CreateCompleteRawPath())
+    if getattr(FreeCAD.ActiveDocument.WirePath, 'FeedPlanner', False):
+        export_path = planExportFeeds(export_path)
+
+    if getattr(FreeCAD.ActiveDocument.WirePath, 'SyncSides', False):
+        export_path = syncExportSides(export_path)
+
+    return export_path
+
+
+def simplifyExportPath(complete_raw_path):
+    tolerance = getattr(FreeCAD.ActiveDocument.WirePath, 'SimplifyTolerance', 0.0)
+    if tolerance <= 0:
+        return complete_raw_path
+
+    anchors = NiCrCore.matchingPoints(complete_raw_path[0], linkAnchorPoints())
+    with NiCrProfile.stage('simplifyPath'):
+        export_path, removed, deviation = NiCrCore.simplifyPath(complete_raw_path,
+                                                                tolerance, anchors)
+
+    NiCrProfile.count('simplified points', removed)
+    FreeCAD.Console.PrintMessage('Path simplification: ' + str(removed) + ' of ' +
+                                 str(len(complete_raw_path[0])) + ' points removed'
+                                 ' (max deviation ' + str(round(deviation, 4)) +
+                                 ' mm)\n')
+    return export_path
+
+
+def planExportFeeds(export_path):
+    # per segment speeds from the corners of the path and MaxAcceleration,
+    # never over the path speeds nor MaxCutSpeed (see NiCrCore.planFeeds)
+    wp = FreeCAD.ActiveDocument.WirePath
+    with NiCrProfile.stage('planFeeds'):
+        planned_path, planned_time, route_time = NiCrCore.planFeeds(
+            export_path, wp.MaxCutSpeed, wp.MaxAcceleration, wp.JunctionDeviation)
+
+    # the firmware estimate of estimateCutTime for the program with and
+    # without the planner (negative differences are time lost)
+    zero_point = FreeCAD.ActiveDocument.NiCrMachine.VirtualMachineZero
+    planes = NiCrSimMachine.exportPlanes()
+    planned_estimate = NiCrKinematics.simulateRoute(planned_path, zero_point,
+                                                    planes=planes).cutTime()
+    route_estimate = NiCrKinematics.simulateRoute(export_path, zero_point,
+                                                  planes=planes).cutTime()
+    FreeCAD.Console.PrintMessage('Feed planner: ' + str(len(planned_path[2])) +
+                                 ' speed commands, cut time at the exported '
+                                 'speeds ' + str(round(planned_time, 1)) + ' s (' +
+                                 str(round(route_time, 1)) + ' s without the planner, ' +
+                                 str(round(route_time - planned_time, 1)) + ' s saved), '
+                                 'firmware estimate ' + str(round(planned_estimate, 1)) +
+                                 ' s (' + str(round(route_estimate, 1)) + ' s, ' +
+                                 str(round(route_estimate - planned_estimate, 1)) +
+                                 ' s saved)\n')
+    return planned_path
+
+
+def syncExportSides(export_path):
+    # reports the segments where the short side dwells and converts the path
+    # speeds (faster side) to firmware feeds (see NiCrCore.syncSideSpeeds)
+    FreeCAD.Console.PrintMessage(NiCrCore.dwellReport(
+        export_path, FreeCAD.ActiveDocument.WirePath.DwellRatio))
+    with NiCrProfile.stage('syncSideSpeeds'):
+        return NiCrCore.syncSideSpeeds(export_path)
+
+
+def selectionEnd(sel):
+    # link end at the path point picked in a selection
+    point = sel.SubObjects[0].Point
+    return (sel.Object, pointFromPath(point, sel.Object), point)
+
+
+def pathPointEnd(path_obj, index):
+    # link end at the point index of path_obj
+    return (path_obj, index, FreeCAD.Vector(path_obj.RawPath[0][index]))
+
+
+def createLinkPath(endA, endB, auto=False):
+    # adds a LinkPath between two link ends to the WirePath folder
+    link_name = 'Link_' + endA[0].Name[8:] + '_' + endB[0].Name[8:]
+    LinkObj = FreeCAD.ActiveDocument.addObject('Part::FeaturePython', link_name)
+    # initialize link object
+    LinkPath(LinkObj, endA, endB, auto)
+    LinkPathViewProvider(LinkObj.ViewObject)
+    # link representation
+    LinkObj.ViewObject.Transparency = 15
+    LinkObj.ViewObject.DisplayMode = "Shaded"
+    # add to folder
+    FreeCAD.ActiveDocument.WirePath.addObject(LinkObj)
+    return LinkObj
+
+
+def linkLength(features_A, features_B):
+    # length of a straight link, see NiCrCore.linkFeatures
+    return float(numpy.sqrt(((features_A - features_B)**2).sum()))
+
+
+def autoRoute():
+    # Replaces the links of the previous auto route with the shortest set of
+    # links that joins every ShapePath to the one of the InitialPath (see
+    # NiCrCore.routeLinks) and reports the link travel saved. The new links
+    # join every path, so links made by hand are replaced too, but only after
+    # the user confirms it. The whole change is one undo step
+    t0 = time.time()
+    doc = FreeCAD.ActiveDocument
+    initial = doc.getObject('InitialPath')
+    if initial is None:
+        FreeCAD.Console.PrintError('Auto route needs an initial path\n')
+        return []
+
+    paths = [obj for obj in doc.Objects if isinstance(getattr(obj, 'Proxy', None), ShapePath)]
+    names = [p.Name for p in paths]
+    if initial.PathName not in names:
+        FreeCAD.Console.PrintError('Auto route: the initial path starts on ' +
+                                   initial.PathName + ', which is not a path of the '
+                                   'document. Redefine the initial path\n')
+        return []
+
+    root = names.index(initial.PathName)
+    routes = [(p.RawPath[0], p.RawPath[1]) for p in paths]
+    old_links = [obj for obj in doc.Objects if isinstance(getattr(obj, 'Proxy', None), LinkPath)]
+    manual = [obj for obj in old_links if not(getattr(obj, 'AutoRouted', False))]
+    if manual:
+        answer = QtGui.QMessageBox.question(
+            FreeCADGui.getMainWindow(), 'Auto route',
+            str(len(manual)) + ' links were not created by Auto route. '
+            'Replace them with the new links?',
+            QtGui.QMessageBox.Yes | QtGui.QMessageBox.Cancel, QtGui.QMessageBox.Cancel)
+        if answer != QtGui.QMessageBox.Yes:
+            FreeCAD.Console.PrintMessage('Auto route cancelled\n')
+            return []
+
+    doc.openTransaction('Auto route')
+    try:
+        # current links
+        old_length = 0.0
+        for obj in old_links:
+            try:
+                path_A = paths[names.index(obj.PathNameA)].RawPath
+                path_B = paths[names.index(obj.PathNameB)].RawPath
+                old_length += linkLength(
+                    NiCrCore.linkFeatures(path_A[0][obj.PathIndexA], path_A[1][obj.PathIndexA]),
+                    NiCrCore.linkFeatures(path_B[0][obj.PathIndexB], path_B[1][obj.PathIndexB]))
+
+            except (ValueError, IndexError):
+                pass
+
+            doc.removeObject(obj.Name)
+
+        links = NiCrCore.routeLinks(routes, root)
+        created = []
+        for parent, a, child, b, length in links:
+            created.append(createLinkPath(pathPointEnd(paths[parent], a),
+                                          pathPointEnd(paths[child], b), auto=True))
+
+        doc.recompute()
+
+    except Exception:
+        doc.abortTransaction()
+        raise
+
+    doc.commitTransaction()
+    # every link is travelled twice (to the linked path and back)
+    travel = 2*sum(link[4] for link in links)
+    chain = 2*NiCrCore.chainLength(routes, [root] + [i for i in range(len(paths)) if i != root])
+    message = ('Auto route: ' + str(len(links)) + ' links, ' + str(round(travel, 1)) +
+               ' mm of link travel (document order: ' + str(round(chain, 1)) + ' mm')
+    if old_links:
+        message += ', previous ' + str(len(old_links)) + ' links: ' + \
+                   str(round(2*old_length, 1)) + ' mm'
+
+    FreeCAD.Console.PrintMessage(message + '), saved ' +
+                                 str(round((2*old_length if old_links else chain) - travel, 1)) +
+                                 ' mm in ' + str(round(time.time() - t0, 2)) + ' s\n')
+    return created
+
+
+def createShapePath(selObj, raw_path=None):
+    # adds the ShapePath of selObj to the WirePath folder (created if needed)
+    try:
+        WPFolder = FreeCAD.ActiveDocument.WirePath
+
+    except:
+        WPFolder = FreeCAD.ActiveDocument.addObject('App::DocumentObjectGroupPython', 'WirePath')
+        WirePathFolder(WPFolder)
+        WirePathViewProvider(WPFolder)
+
+    shapepath_name = 'ShapePath_' + selObj.Name
+    shapepathobj = FreeCAD.ActiveDocument.addObject('Part::FeaturePython', shapepath_name)
+    # initialize python object
+    ShapePath(shapepathobj, selObj, raw_path)
+    ShapePathViewProvider(shapepathobj.ViewObject)
+    # modify color
+    shapepathobj.ViewObject.ShapeColor = (1.0, 1.0, 1.0)
+    shapepathobj.ViewObject.LineWidth = 1.0
+    WPFolder.addObject(shapepathobj)
+    return shapepathobj
+
+
+def batchCreateShapePaths(objects):
+    # Routes many objects at once with the default ShapePath settings
+    # (SHAPEPATH_DEFAULTS): the wire paths are computed one after another
+    # behind a cancellable progress dialog and the ShapePaths are created
+    # when all of them are ready
+    FCW = FreeCADGui.getMainWindow()
+    dialog = QtGui.QProgressDialog('Computing wire paths...', 'Cancel', 0,
+                                   len(objects), FCW)
+    dialog.setWindowTitle('Route')
+    dialog.setWindowModality(QtCore.Qt.WindowModal)
+    dialog.setMinimumDuration(0)
+    t0 = time.time()
+    routes = []
+    for selObj in objects:
+        dialog.setValue(len(routes))
+        QtGui.QApplication.processEvents()
+        if dialog.wasCanceled():
+            dialog.close()
+            FreeCAD.Console.PrintMessage('Route cancelled\n')
+            return []
+
+        try:
+            routes.append(ShapeToNiCrPath(selObj, SHAPEPATH_DEFAULTS['PointDensity'],
+                                          reverse=SHAPEPATH_DEFAULTS['Reverse'],
+                                          tolerance=SHAPEPATH_DEFAULTS['ChordTolerance']))
+
+        except Exception as e:
+            routes.append(e)
+
+    dialog.close()
+    created = []
+    for selObj, route in zip(objects, routes):
+        if isinstance(route, Exception):
+            FreeCAD.Console.PrintError('Route of ' + selObj.Label + ' failed: ' +
+                                       str(route) + '\n')
+            continue
+
+        created.append(createShapePath(selObj, route))
+
+    FreeCAD.Console.PrintMessage(str(len(created)) + ' wire paths routed in ' +
+                                 str(round(time.time() - t0, 2)) + ' s\n')
+    return created
+
+
+def edgeCurve(edge, reverse=False):
+    # function s (0..1) -> point of edge, s=0 at the end if reverse
+    u0 = edge.FirstParameter
+    u1 = edge.LastParameter
+    if reverse:
+        u0, u1 = u1, u0
+
+    def curve(s):
+        p = edge.valueAt(u0 + s*(u1 - u0))
+        return (p.x, p.y, p.z)
+
+    return curve
+
+
+def shapeFaceData(shape, precision, tolerance=0.0):
+    # Extracts the transversal faces of a shape as plain data for the path
+    # core (see NiCrCore, shape faces). Both boundary edges of a face are
+    # discretized here, the faces are ordered later.
     # precision -> distance between discrete points of the trajectory (mm/point)
+    # tolerance -> if > 0, curved edges are sampled adaptively with this max
+    # chord error (mm) instead of using precision
     #------------------------------------------------------------------------- 0
     # split faces in reference to XY plane
     transversal_faces = []
     parallel_faces = []
-    for face in selected_object.Shape.Faces:
+    for face in shape.Faces:
         if (face.normalAt(0, 0).cross(FreeCAD.Vector(0, 0, 1))).Length > 0.001:
             transversal_faces.append(face)
 
         else:
             parallel_faces.append(face)
 
+    #------------------------------------------------------------------------- 1
+    # boundary edges of every face: side A lies on the first parallel face
+    CG0 = parallel_faces[0].CenterOfMass
+    CG1 = parallel_faces[1].CenterOfMass
+    faces = []
+    for face in transversal_faces:
+        edge_A = None
+        edge_B = None
+        lateral = []
+        for edge in face.Edges:
+            if abs(edge.CenterOfMass.z-CG0.z) < 0.01:
+                edge_A = edge
 
-    def doFacesTouch(face_A, face_B):
-        # auxiliar function to test if two faces share and edge
-        for edge_A in face_A.Edges:
-            for edge_B in face_B.Edges:
-                v_AB = (edge_A.CenterOfMass - edge_B.CenterOfMass).Length
-                if v_AB < 0.001:
-                    return True
+            elif abs(edge.CenterOfMass.z-CG1.z) < 0.01:
+                edge_B = edge
 
-        return False
+            else:
+                lateral.append(edge)
+
+        # is edge B running in the same direction as edge A?
+        a1, a2 = edge_A.discretize(2)
+        b1, b2 = edge_B.discretize(2)
+        same_direction = (a2-b2).Length + (a1-b1).Length <= (a2-b1).Length + (a1-b2).Length
+        for edge in lateral:
+            q1, q2 = edge.discretize(2)
+            if min((a2-q1).Length, (a2-q2).Length) < 0.01:
+                same_direction = min((b2-q1).Length, (b2-q2).Length) < 0.01
+                break
+
+        #--------------------------------------------------------------------- 2
+        # discretize both edges, B is reversed to follow A
+        if str(edge_A.Curve)[1:5] == 'Line' and str(edge_B.Curve)[1:5] == 'Line':
+            TA = edge_A.discretize(2)
+            TB = edge_B.discretize(2)
+
+        elif tolerance > 0:
+            # both sides are sampled at the same edge parameters
+            TA, TB = NiCrCore.pairedSamples(edgeCurve(edge_A),
+                                            edgeCurve(edge_B, not(same_direction)),
+                                            tolerance)
+            same_direction = True
 
-    #------------------------------------------------------------------------- 1
-    # order transversal faces to be consecutive
-    consecutive_faces = []
-    consecutive_faces.append(transversal_faces[0])
-    #reverse = True  # reverse the tool trajectory with this boolean
-    if reverse:
-        transversal_faces.reverse()
-
-    for i in xrange( len( transversal_faces ) ):
-        face_A = consecutive_faces[i]
-        for face_B in transversal_faces:
-            v_AB = (face_A.CenterOfMass - face_B.CenterOfMass).Length
-            if v_AB > 0.001:
-                if doFacesTouch( face_A, face_B ):
-                    appended = False
-                    for face_C in consecutive_faces:
-                        if (face_B.CenterOfMass - face_C.CenterOfMass).Length < 0.001:
-                            appended = True
-
-                    if not(appended):
-                        consecutive_faces.append( face_B )
-                        break
+        else:
+            n_discretize = max(edge_A.Length/precision, edge_B.Length/precision)
+            n_discretize = max(2, n_discretize)
+            TA = edge_A.discretize(int(n_discretize))
+            TB = edge_B.discretize(int(n_discretize))
 
+        TA = [tuple(p) for p in TA]
+        TB = [tuple(p) for p in TB]
+        if not(same_direction):
+            TB.reverse()
 
-    #------------------------------------------------------------------------- 2
-    # project path vertexes to a XY plane placed at wire start and end so they form
-    # the toolpath
-    def vertexesInCommon( face_a, face_b ):
-        # aux function to find the vertexes shared by two connected rectangles
-        for vertex_a in face_a.Vertexes:
-            for vertex_b in face_b.Vertexes:
-                if (vertex_a.Point - vertex_b.Point).Length < 0.01:
-                    cm_a = vertex_a
-                    for v_a in face_a.Vertexes:
-                        for v_b in face_b.Vertexes:
-                            if (v_a.Point-cm_a.Point).Length > 0.001:
-                                if (v_a.Point - v_b.Point ).Length < 0.001:
-                                    cm_b = v_a
-                                    return cm_a, cm_b
-
-
-    # discretize length
-    #discrete_length = 20 # mm/point
-    discrete_length = precision
-    consecutive_faces.append(consecutive_faces[0])
-    trajectory = []
-    for i in xrange(len(consecutive_faces)-1):
-        face_a = consecutive_faces[i]
-        face_b = consecutive_faces[i+1]
-        cm_a, cm_b = vertexesInCommon( face_a, face_b )
-        CG0 = parallel_faces[0].CenterOfMass
-        CG1 = parallel_faces[1].CenterOfMass
-        edge_list = []
-        for edge in face_a.Edges:
-            if abs(edge.CenterOfMass.z-CG0.z) < 0.01:
-                edge_list.append( edge )
+        faces.append({'edges': [tuple(edge.CenterOfMass) for edge in face.Edges],
+                      'vertexes': [tuple(v.Point) for v in face.Vertexes],
+                      'A': TA,
+                      'B': TB})
 
-            if abs(edge.CenterOfMass.z-CG1.z)< 0.01:
-                edge_list.append( edge )
+    return faces
 
-        tr_edge = []
-        for edge in edge_list:
-            p1,p2 = edge.discretize(2)
-            if (p2-cm_a.Point).Length < 0.01:
-                data = [ edge, False ] # 0 or 1 means normal or reverse edge
-                tr_edge.append( data )
 
-            elif (p1-cm_a.Point).Length < 0.01:
-                data = [ edge, True ]
-                tr_edge.append( data )
+def ShapeToNiCrPath(selected_object, precision, reverse=False, tolerance=0.0):
+    # Creates the wire path for an input shape. Returns a list of points with
+    # a structure: trajectory_list[machine_side][xyz]
+    # precision -> distance between discrete points of the trajectory (mm/point)
+    # tolerance -> if > 0, curved edges are sampled adaptively with this max
+    # chord error (mm) instead of using precision
+    with NiCrProfile.stage('ShapeToNiCrPath: faces'):
+        faces = shapeFaceData(selected_object.Shape, precision, tolerance)
 
-            if (p2-cm_b.Point).Length < 0.01:
-                data = [ edge, False ] # 0 or 1 means normal or reverse edge
-                tr_edge.append( data )
+    with NiCrProfile.stage('ShapeToNiCrPath: route'):
+        route = NiCrCore.routeFromFaces(faces, reverse).toRoute()[:2]
 
-            elif (p1-cm_b.Point).Length < 0.01:
-                data = [ edge, True ]
-                tr_edge.append( data )
+    NiCrProfile.count('routed faces', len(faces))
+    NiCrProfile.count('routed points', len(route[0]))
+    return route
 
 
-        edge_trajectory = []
-        if str(edge_list[0].Curve)[1:5] == 'Line' and str(edge_list[1].Curve)[1:5] == 'Line':
-            TA = tr_edge[0][0].discretize(2)
-            if tr_edge[0][1]:
-                TA.reverse()
+PATH_REPRESENTATIONS = ['Loft', 'Ruled surface', 'Wires']
 
-            TB = tr_edge[1][0].discretize(2)
-            if tr_edge[1][1]:
-                TB.reverse()
 
-        else:
-            n_discretize = max( tr_edge[0][0].Length/discrete_length, tr_edge[1][0].Length/discrete_length )
-            n_discretize = max( 2, n_discretize)
-            TA = tr_edge[0][0].discretize( int(n_discretize) )
-            if tr_edge[0][1]:
-                TA.reverse()
-
-            TB = tr_edge[1][0].discretize( int(n_discretize) )
-            if tr_edge[1][1]:
-                TB.reverse()
-
-        traj_data = [ TA, TB ]
-        trajectory.append(traj_data)
-
-    # ------------------------------------------------------------------------ 3
-    # trajectory structure
-    # trajectory [ faces ] [ sideA, sideB ], [TrajectoryPoints (min of 2) ], [X,Y,Z]
-    # -> clean trajectory list from repeated elements:
-    clean_list_A = []
-    clean_list_B = []
-    for pt in trajectory:
-        for i in range( len( pt[0] ) -1):
-            PA_0 = pt[0][i]
-            PA_1 = pt[0][i+1]
-            if (PA_0 - PA_1).Length > 0.001:
-                clean_list_A.append( pt[0][i] )
-                clean_list_B.append( pt[1][i] )
-            else:
-                pass
-    clt = ( clean_list_A, clean_list_B ) # clt -> clean trajectory
-
-    # -> transform trajectory to a simple list to allow JSON serialization (save list)
-    Tr_list_A = []
-    Tr_list_B = []
-    for i in xrange( len( clt[0] ) ):
-        PA = ( clt[0][i].x, clt[0][i].y, clt[0][i].z )
-        PB = ( clt[1][i].x, clt[1][i].y, clt[1][i].z )
-        Tr_list_A.append( PA )
-        Tr_list_B.append( PB )
-
-    Tr_list_A.append( Tr_list_A[0] )
-    Tr_list_B.append( Tr_list_B[0] )
-    wirepath = ( Tr_list_A, Tr_list_B )
-    # check that sideA  has the lower z value:
-    if Tr_list_A[0][2] > Tr_list_B[0][2]:
-        wirepath = ( Tr_list_B, Tr_list_A )
-
-    return wirepath
-
-
-def PathToShape(point_list):
-    # creates a compound of faces from a NiCr point list to representate the wire
-    # trajectory
+def pathRepresentation():
+    # PathRepresentation of the WirePath folder ('Loft' if there is none)
+    try:
+        return FreeCAD.ActiveDocument.WirePath.PathRepresentation
+
+    except AttributeError:
+        return 'Loft'
+
+
+# recently computed routes: routeKey -> [RawPath, displayKey, display shape]
+_route_cache = NiCrCore.LRUCache(32)
+
+
+# content hashes of recently seen shapes: Shape.hashCode() -> [shape, sha1]
+_shape_hashes = NiCrCore.LRUCache(64)
+
+
+def shapeHash(shape):
+    # content hash of a shape (geometry and placement). The BREP is only
+    # hashed again when the shape itself changes: the entry keeps the shape
+    # (so its hash code can not be reused by another one) and isSame checks
+    # it is still the same topology and placement
+    entry = _shape_hashes.get(shape.hashCode())
+    if entry is not None and entry[0].isSame(shape):
+        return entry[1]
+
+    brep = shape.exportBrepToString()
+    if not(isinstance(brep, bytes)):
+        brep = brep.encode('utf-8')
+
+    digest = hashlib.sha1(brep).hexdigest()
+    _shape_hashes.put(shape.hashCode(), [shape, digest])
+    return digest
+
+
+def samePath(path_a, path_b):
+    # equal points (the saved RawPath holds lists instead of tuples)
+    if not(path_a) or not(path_b):
+        return not(path_a) and not(path_b)
+
+    return all(len(path_a[i]) == len(path_b[i]) and
+               numpy.array_equal(path_a[i], path_b[i]) for i in range(2))
+
+
+def routeKey(obj):
+    # everything the RawPath of a ShapePath depends on
+    shape = FreeCAD.ActiveDocument.getObject(obj.ShapeName).Shape
+    return (shapeHash(shape), obj.PointDensity, obj.Reverse,
+            getattr(obj, 'ChordTolerance', 0.0))
+
+
+def displayKey(obj):
+    # everything the displayed shape of a path depends on, besides RawPath
+    return (getattr(obj, 'DisplayTolerance', 0.0), pathRepresentation())
+
+
+def displayShape(obj):
+    # shape of a path object, reduced to its DisplayTolerance (the RawPath
+    # itself keeps full resolution for export and simulation)
+    tolerance = getattr(obj, 'DisplayTolerance', 0.0)
+    if tolerance > 0:
+        return PathToShape(NiCrCore.decimatePath(obj.RawPath, tolerance))
+
+    return PathToShape(obj.RawPath)
+
+
+@NiCrProfile.timed('PathToShape')
+def PathToShape(point_list, representation=None):
+    # creates the shape that representates the wire trajectory of a NiCr point
+    # list:
+    #   'Loft'          -> compound of one lofted face per segment
+    #   'Ruled surface' -> single ruled surface between the side polylines
+    #   'Wires'         -> compound of the two side polylines (fastest)
+    if representation is None:
+        representation = pathRepresentation()
+
+    if representation != 'Loft' and len(point_list[0]) > 1:
+        side_A = [FreeCAD.Vector(tuple(p)) for p in point_list[0]]
+        side_B = [FreeCAD.Vector(tuple(p)) for p in point_list[1]]
+        try:
+            wire_A = Part.makePolygon(side_A)
+            wire_B = Part.makePolygon(side_B)
+            if representation == 'Wires':
+                return Part.makeCompound([wire_A, wire_B])
+
+            # polylines that can not be paired edge by edge (repeated points
+            # on one side only) fall back to the lofted representation
+            if len(wire_A.Edges) == len(wire_B.Edges):
+                return Part.makeRuledSurface(wire_A, wire_B)
+
+        except Exception:
+            pass
+
     comp = []
     for i in range(len(point_list[0])-1):
         pa_0 = FreeCAD.Vector(tuple(point_list[0][i]))
@@ -688,20 +1168,94 @@ def PathToShape(point_list):
     return Part.makeCompound(comp)
 
 
+# routing between WirePaths (wirepath path link)
 
+# PointIndex cache: (document, shapepath name) -> PointIndex
+# entries are dropped every time the RawPath of the shapepath is regenerated
+_point_index_cache = {}
 
-# routing between WirePaths (wirepath path link)
 
-def pointFromPath(vector, raw_path):
-    # returns the position of vector in raw_path list
-    for side in raw_path:
-        for i in range(len(side)):
-            v = side[i]
-            Fv = FreeCAD.Vector(v[0], v[1], v[2])
-            if (Fv-vector).Length < 0.001:
-                return i
+def invalidatePointIndex(path_obj):
+    _point_index_cache.pop((path_obj.Document.Name, path_obj.Name), None)
+
+
+def nearestPathPoint(vector, path_obj):
+    # returns (index, distance) of the RawPath point of path_obj closest to vector
+    key = (path_obj.Document.Name, path_obj.Name)
+    index = _point_index_cache.get(key)
+    if index is None:
+        index = NiCrCore.PointIndex(path_obj.RawPath)
+        _point_index_cache[key] = index
+
+    return index.nearest((vector[0], vector[1], vector[2]))
+
+
+# (path name, path index, anchor) properties of the objects linked to a path
+LINK_ANCHORS = (('PathNameA', 'PathIndexA', 'AnchorA'),
+                ('PathNameB', 'PathIndexB', 'AnchorB'),
+                ('PathName', 'PathIndex', 'Anchor'))
+
+
+def relinkPath(path_obj, old_raw_path):
+    # Called after the RawPath of path_obj is regenerated: every link, initial
+    # or final path that references it gets the index of the new path point
+    # closest to its anchor. Links whose anchor is now further than the
+    # WirePath LinkTolerance are removed (they need to be re-defined); the
+    # initial and final paths, which every export needs, are re-anchored to
+    # the closest point with a warning instead
+    tolerance = getattr(FreeCAD.ActiveDocument.WirePath, 'LinkTolerance', 1.0)
+    for obj in FreeCAD.ActiveDocument.Objects:
+        path_end = isinstance(getattr(obj, 'Proxy', None), (InitialPath, FinalPath))
+        for name, index, anchor in LINK_ANCHORS:
+            if getattr(obj, name, None) != path_obj.Name:
+                continue
+
+            position = getattr(obj, anchor, None)
+            if position is None:
+                # links created before anchors existed: old point position
+                try:
+                    position = FreeCAD.Vector(old_raw_path[0][getattr(obj, index)])
+
+                except (IndexError, TypeError):
+                    if not(path_end):
+                        FreeCAD.ActiveDocument.removeObject(obj.Name)
+                        break
+
+                    position = FreeCAD.Vector(path_obj.RawPath[0][0])
+
+                obj.addProperty('App::PropertyVector', anchor, 'Link Data')
+                setattr(obj, anchor, position)
+
+            i, distance = nearestPathPoint(position, path_obj)
+            if distance > tolerance:
+                if not(path_end):
+                    FreeCAD.Console.PrintWarning(obj.Label + ' removed: ' + path_obj.Label +
+                                                 ' no longer passes through its anchor (' +
+                                                 str(round(distance, 3)) + ' mm away)\n')
+                    FreeCAD.ActiveDocument.removeObject(obj.Name)
+                    break
+
+                FreeCAD.Console.PrintWarning(obj.Label + ' moved to the closest point of ' +
+                                             path_obj.Label + ' (' + str(round(distance, 3)) +
+                                             ' mm from its anchor), check it\n')
+                setattr(obj, anchor, FreeCAD.Vector(path_obj.RawPath[0][i]))
 
+            if getattr(obj, index) != i:
+                setattr(obj, index, i)
 
+
+def pointFromPath(vector, path_obj, tolerance=0.001):
+    # returns the position of vector in the RawPath list of path_obj
+    i, distance = nearestPathPoint(vector, path_obj)
+    if distance > tolerance:
+        FreeCAD.Console.PrintWarning('Selected point is not on ' + path_obj.Label +
+                                     ', using the closest path point (' +
+                                     str(round(distance, 3)) + ' mm away)\n')
+
+    return i
+
+
+@NiCrProfile.timed('writeNiCrFile')
 def writeNiCrFile(wirepath, directory):
     """
     This functions creates a file containing the .nicr instructions that can be
@@ -716,78 +1270,102 @@ def writeNiCrFile(wirepath, directory):
     path_name = FreeCAD.ActiveDocument.WirePath.Label
     mxspeed = FreeCAD.ActiveDocument.WirePath.MaxCutSpeed
     mxtemp = FreeCAD.ActiveDocument.WirePath.MaxWireTemp
-    mzero = FreeCAD.ActiveDocument.NiCrMachine.VirtualMachineZero
     zlength = FreeCAD.ActiveDocument.NiCrMachine.ZLength
-    # write header
-    nicr_file.write('PATH NAME:' + path_name + '\n')
-    nicr_file.write('DATE: ' + time.strftime("%c") + '\n')
-    nicr_file.write('Exporter version 0.2\n')
-    nicr_file.write('SETTINGS ------------------------- \n')
-    nicr_file.write('Z AXIS LENGTH: ' + str(zlength) + '\n')
-    nicr_file.write('MAX FEED SPEED: ' + str(mxspeed) + '\n')
-    nicr_file.write('MAX WIRE TEMPERATURE: ' + str(mxtemp) + '\n')
-    nicr_file.write('END SETTINGS --------------------- \n')
-    # write machine start
-    nicr_file.write('INIT\n')
-    nicr_file.write('POWER ON\n')
-    # write trajectories with compensation for virtual machine ZeroPoint <----
     zeroPoint = FreeCAD.ActiveDocument.NiCrMachine.VirtualMachineZero
-    n = 0
-    for i in range(len(wirepath[0])):
-        if i == wirepath[2][n][0]:
-            nicr_file.write('WIRE ' + str(wirepath[2][n][1]))
-            nicr_file.write('SPEED ' + str(wirepath[2][n][2]))
-            n += 1
-
-        AX = str(round(wirepath[0][i][0] - zeroPoint.x, 3)) + ' '
-        AY = str(round(wirepath[0][i][1] - zeroPoint.y, 3)) + ' '
-        BX = str(round(wirepath[1][i][0] - zeroPoint.x, 3)) + ' '
-        BY = str(round(wirepath[1][i][1] - zeroPoint.y, 3)) + '\n'
-        ins = 'MOVE ' + AX + AY + BX + BY
-        nicr_file.write(ins)
-    # write machine shutdown
-    nicr_file.write('POWER OFF\n')
-    nicr_file.write('END')
-    # close file
+    NiCrCore.writeNiCrProgram(nicr_file, wirepath, zeroPoint, path_name,
+                              zlength, mxspeed, mxtemp,
+                              planes=NiCrSimMachine.exportPlanes())
     nicr_file.close()
     FreeCAD.Console.PrintMessage('NiCr code generated succesfully\n')
     #  TODO -> establish standard header and footer as cura does
 
 
+@NiCrProfile.timed('writeNiCrBinaryFile')
+def writeNiCrBinaryFile(wirepath, directory):
+    """
+    Binary sibling of writeNiCrFile: creates a .nicrb file with the same
+    program stored as packed float32 coordinates and a separate instruction
+    table (see NiCrCore, .nicrb binary programs). With the StepBlocks option
+    of the WirePath folder the coordinates are stored as step blocks
+    """
+    binary_file = open(directory + '.nicrb', 'wb')
+    path_name = FreeCAD.ActiveDocument.WirePath.Label
+    mxspeed = FreeCAD.ActiveDocument.WirePath.MaxCutSpeed
+    mxtemp = FreeCAD.ActiveDocument.WirePath.MaxWireTemp
+    zlength = FreeCAD.ActiveDocument.NiCrMachine.ZLength
+    zeroPoint = FreeCAD.ActiveDocument.NiCrMachine.VirtualMachineZero
+    record_type = NiCrCore.NICRB_FLOAT
+    scale = (1.0, 1.0, 1.0, 1.0)
+    if getattr(FreeCAD.ActiveDocument.WirePath, 'StepBlocks', False):
+        record_type = NiCrCore.NICRB_BLOCKS
+        scale = tuple(FreeCAD.ActiveDocument.WirePath.StepScale)
+
+    planes = NiCrSimMachine.exportPlanes()
+    NiCrCore.writeNiCrBinaryProgram(binary_file, wirepath, zeroPoint, path_name,
+                                    zlength, mxspeed, mxtemp, record_type, scale,
+                                    planes=planes)
+    binary_file.close()
+    if record_type == NiCrCore.NICRB_BLOCKS:
+        moves = NiCrCore.programMoves(NiCrCore.WirePath.fromRoute(wirepath),
+                                      zeroPoint, planes)
+        FreeCAD.Console.PrintMessage(NiCrKinematics.planningReport(moves, scale))
+
+    FreeCAD.Console.PrintMessage('NiCr binary code generated succesfully\n')
+
+
 def saveNiCrFile():
     FCW = FreeCADGui.getMainWindow()
     save_directory = QtGui.QFileDialog.getSaveFileName(FCW,
                                                        'Save Wirepath as:',
                                                        '/home',
-                                                       '.nicr')
-    full_path = CreateCompleteRawPath()
-    writeNiCrFile(full_path, str(save_directory[0]))
-    FreeCAD.Console.PrintMessage('NiCr code saved: ' + str(save_directory[0]) + '\n')
+                                                       'NiCr program (*.nicr);;'
+                                                       'NiCr binary program (*.nicrb)')
+    file_name = str(save_directory[0])
+    binary = file_name.endswith('.nicrb') or '.nicrb' in str(save_directory[1])
+    for extension in ('.nicrb', '.nicr'):
+        if file_name.endswith(extension):
+            file_name = file_name[:-len(extension)]
+
+    full_path = CreateExportPath()
+    if binary:
+        writeNiCrBinaryFile(full_path, file_name)
+
+    else:
+        writeNiCrFile(full_path, file_name)
+
+    FreeCAD.Console.PrintMessage('NiCr code saved: ' + file_name + '\n')
+    # stage breakdown since the last export (route generation included)
+    NiCrProfile.report(os.environ.get('NICR_PROFILE_JSON') or
+                       file_name + '.profile.json')
 
 
 def importNiCrFile():
     FCW = FreeCADGui.getMainWindow()
     file_dir = QtGui.QFileDialog.getOpenFileName(FCW,
                                                  'Load .nicr file:',
-                                                 '/home')
-    readNiCrFile(file_dir[0])
+                                                 '/home',
+                                                 'NiCr programs (*.nicr *.nicrb)')
+    try:
+        readNiCrFile(file_dir[0])
+
+    except NiCrCore.NiCrFileError as error:
+        FreeCAD.Console.PrintError('Invalid .nicr file, ' + str(error) + '\n')
+        return
+
     FreeCAD.Console.PrintMessage('Path succesfully imported\n')
 
 
 def readNiCrFile(file_dir):
-    nicr_file = open(file_dir, 'r')
-    path_A = []
-    path_B = []
-    zlength = 0
-    for line in nicr_file:
-        line = line.split(' ')
-        if line[0] == 'Z':
-            zlength = float(line[3])
-
-        if zlength != 0 and line[0] == 'MOVE':
-            path_A.append((float(line[1]), float(line[2]), 0))
-            path_B.append((float(line[3]), float(line[4]), zlength))
-
-    complete_path = (path_A, path_B)
-    obj = FreeCAD.ActiveDocument.addObject('Part::Feature', 'Imported')
-    obj.Shape = PathToShape(complete_path)
+    if file_dir.endswith('.nicrb'):
+        program = NiCrCore.NiCrBinaryProgram(file_dir)
+        complete_path = program.wirePath().toRoute()
+        program.close()
+
+    else:
+        nicr_file = open(file_dir, 'r')
+        complete_path = NiCrCore.readNiCrProgram(nicr_file).toRoute()
+        nicr_file.close()
+
+    obj = FreeCAD.ActiveDocument.addObject('Part::FeaturePython', 'Imported')
+    ImportedPath(obj, complete_path)
+    ImportedPathViewProvider(obj.ViewObject)
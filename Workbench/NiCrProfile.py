@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# NiCr (Hot Wire CNC Cutter) workbench for FreeCAD
+# (c) 2016 Javier Martínez García
+#***************************************************************************
+#*   (c) Javier Martínez García 2016                                       *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License (GPL)            *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Lesser General Public License for more details.                   *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with FreeCAD; if not, write to the Free Software        *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************/
+
+import contextlib
+import functools
+import json
+import os
+import time
+
+# Opt-in timers and counters for the path pipeline. Profiling is on when the
+# NICR_PROFILE environment variable is set (not '0') or when the Profile
+# property of the WirePath folder is true. Stages accumulate until report()
+# is called (the export prints and clears them), so the route generation
+# done on recompute shows up in the next export report.
+#   with NiCrProfile.stage('name'): ...     time a block
+#   @NiCrProfile.timed('name')              time every call of a function
+#   NiCrProfile.count('name', n)            add n to a counter
+# report(json_name) also dumps the breakdown as JSON (the export writes it
+# next to the program as <name>.profile.json, or to NICR_PROFILE_JSON).
+
+_stages = {}    # name -> [calls, total s, max s]
+_counters = {}  # name -> value
+
+
+def enabled():
+    if os.environ.get('NICR_PROFILE', '0') not in ('', '0'):
+        return True
+
+    try:
+        import FreeCAD
+        return bool(getattr(FreeCAD.ActiveDocument.WirePath, 'Profile', False))
+
+    except (ImportError, AttributeError):
+        return False
+
+
+def record(name, seconds):
+    entry = _stages.setdefault(name, [0, 0.0, 0.0])
+    entry[0] += 1
+    entry[1] += seconds
+    entry[2] = max(entry[2], seconds)
+
+
+@contextlib.contextmanager
+def stage(name):
+    if not(enabled()):
+        yield
+        return
+
+    t0 = time.time()
+    try:
+        yield
+
+    finally:
+        record(name, time.time() - t0)
+
+
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, n=1):
+    if enabled():
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def reset():
+    _stages.clear()
+    _counters.clear()
+
+
+def summary():
+    # machine readable report (JSON friendly dict)
+    stages = {}
+    for name, (calls, total, peak) in _stages.items():
+        stages[name] = {'calls': calls, 'total': total,
+                        'mean': total / calls, 'max': peak}
+
+    return {'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'stages': stages,
+            'counters': dict(_counters)}
+
+
+def formatSummary(data):
+    lines = ['NiCr profile -------------------------------------------',
+             '%-28s %6s %10s %10s %10s' % ('stage', 'calls', 'total (s)', 'mean (s)', 'max (s)')]
+    for name in sorted(data['stages'], key=lambda k: -data['stages'][k]['total']):
+        s = data['stages'][name]
+        lines.append('%-28s %6d %10.4f %10.4f %10.4f' % (name, s['calls'], s['total'],
+                                                        s['mean'], s['max']))
+
+    for name in sorted(data['counters']):
+        lines.append('%-28s %6d' % (name, data['counters'][name]))
+
+    return '\n'.join(lines) + '\n'
+
+
+def dumpJSON(file_name, data=None):
+    json_file = open(file_name, 'w')
+    json.dump(data or summary(), json_file, indent=1, sort_keys=True)
+    json_file.close()
+
+
+def report(json_name=None):
+    # prints the stage breakdown to the report view (or stdout), dumps it to
+    # json_name (or NICR_PROFILE_JSON) and clears the records
+    if not(enabled()):
+        return None
+
+    data = summary()
+    try:
+        import FreeCAD
+        FreeCAD.Console.PrintMessage(formatSummary(data))
+
+    except ImportError:
+        print(formatSummary(data).rstrip('\n'))
+
+    json_name = json_name or os.environ.get('NICR_PROFILE_JSON')
+    if json_name:
+        dumpJSON(json_name, data)
+
+    reset()
+    return data
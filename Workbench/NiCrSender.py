@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+# NiCr (Hot Wire CNC Cutter) workbench for FreeCAD
+# (c) 2016 Javier Martínez García
+#***************************************************************************
+#*   (c) Javier Martínez García 2016                                       *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU General Public License (GPL)            *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Lesser General Public License for more details.                   *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with FreeCAD; if not, write to the Free Software        *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************/
+
+import collections
+import io
+import os
+import select
+import time
+import numpy
+import NiCrCore
+import NiCrKinematics
+
+# Streams a .nicr / .nicrb program to the machine over a serial port.
+# The firmware answers every instruction in order: it echoes the instruction
+# name and, except for SPEED, prints DONE when the instruction is finished.
+# The sender keeps up to `window` instructions in flight, limited by the bytes
+# the firmware can buffer (buffer_size), and completes them in order as the
+# answers arrive. If nothing is received for `timeout` seconds the send stops
+# with NiCrSenderError: the firmware can not tell a repeated instruction from
+# a new one, so resending is never safe. MOVE values are absolute positions
+# (the convention of NiCrKinematics and NiCrEmulator): a resent MOVE whose
+# DONE was only late takes the wire back to an earlier point and over the
+# path again, through material that is already cut (and NiCrFW.ino as
+# written, which adds the values as relative steps, would move it twice).
+# With sequenced=True every instruction is sent as 'N<seq> <instruction>' and
+# answered with 'DONE <seq>' by a firmware that executes each sequence number
+# once and only answers repeated ones. Then the instructions in flight are
+# sent again after a timeout (up to `retries` times) and answers to sequence
+# numbers already completed are ignored.
+# NiCrFW.ino reads whatever arrived 10 ms after the first byte as one
+# instruction and keeps a line break as part of the last field, so it needs
+# window=1 (stop and wait) and eol='' (the defaults). Larger windows, with
+# eol='\n', are for firmware that reads its serial buffer line by line.
+# NiCrEmulator emulates both on a pseudo terminal.
+# pyserial is used when it is installed; otherwise POSIX serial devices and
+# pseudo terminals are opened directly.
+#   python NiCrSender.py program.nicr /dev/ttyUSB0
+
+ACK = 'DONE'
+NO_ACK = ('SPEED',)  # echoed by the firmware but not answered with DONE
+
+NiCrCommand = collections.namedtuple('NiCrCommand', ['line', 'text', 'kind', 'args'])
+
+
+class NiCrSenderError(IOError):
+    pass
+
+
+class _LinePort:
+    # line reader on top of _read(timeout) -> bytes
+    def __init__(self):
+        self._buffer = b''
+
+    def readline(self, timeout):
+        # next line without line break, or None after timeout seconds
+        end = time.time() + timeout
+        while b'\n' not in self._buffer:
+            remaining = end - time.time()
+            if remaining <= 0:
+                return None
+
+            self._buffer += self._read(remaining)
+
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return line.rstrip(b'\r').decode('ascii', 'replace')
+
+
+class PosixPort(_LinePort):
+    # serial device or pseudo terminal opened with os.open
+    def __init__(self, name, baudrate=115200):
+        import termios
+        import tty
+        _LinePort.__init__(self)
+        self.fd = os.open(name, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(self.fd)
+        speed = getattr(termios, 'B' + str(baudrate), None)
+        if speed is not None:
+            attributes = termios.tcgetattr(self.fd)
+            attributes[4] = attributes[5] = speed
+            termios.tcsetattr(self.fd, termios.TCSANOW, attributes)
+
+    def _read(self, timeout):
+        if not(select.select([self.fd], [], [], timeout)[0]):
+            return b''
+
+        try:
+            data = os.read(self.fd, 4096)
+
+        except OSError:
+            data = b''
+
+        if not data:
+            raise NiCrSenderError('serial port closed')
+
+        return data
+
+    def write(self, text):
+        data = text.encode('ascii')
+        while data:
+            data = data[os.write(self.fd, data):]
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SerialPort(_LinePort):
+    # pyserial port
+    def __init__(self, name, baudrate=115200):
+        import serial
+        _LinePort.__init__(self)
+        self.port = serial.Serial(name, baudrate, timeout=0.05)
+
+    def _read(self, timeout):
+        self.port.timeout = min(timeout, 0.05)
+        return self.port.read(max(1, self.port.in_waiting))
+
+    def write(self, text):
+        self.port.write(text.encode('ascii'))
+
+    def close(self):
+        self.port.close()
+
+
+def openPort(name, baudrate=115200):
+    try:
+        return SerialPort(name, baudrate)
+
+    except ImportError:
+        return PosixPort(name, baudrate)
+
+
+def programCommands(file_name):
+    # .nicr or .nicrb program -> list of NiCrCommand (header lines excluded).
+    # Text programs are sent as written, binary ones as nicrBinaryToText
+    # writes them
+    if file_name.endswith('.nicrb'):
+        text = io.StringIO()
+        NiCrCore.nicrBinaryToText(file_name, text)
+        lines = text.getvalue().splitlines()
+
+    else:
+        nicr_file = open(file_name, 'r')
+        lines = nicr_file.read().splitlines()
+        nicr_file.close()
+
+    commands = []
+    for record in NiCrCore.parseNiCrProgram(lines):
+        if record.kind != 'HEADER':
+            commands.append(NiCrCommand(record.line, ' '.join(lines[record.line - 1].split()),
+                                        record.kind, record.args))
+
+    return commands
+
+
+def commandTimes(commands, settings=None):
+    # estimated machine time of every command (NiCrKinematics), used to
+    # weight the progress of the ETA
+    settings = settings or NiCrKinematics.FirmwareSettings()
+    times = numpy.full(len(commands), settings.buffer_delay)
+    moves = [i for i, command in enumerate(commands) if command.kind == 'MOVE']
+    if moves:
+        result = NiCrKinematics.simulateMoves([commands[i].args for i in moves], settings)
+        times[moves] = result.time
+
+    return times
+
+
+class SendStats:
+    def __init__(self, commands, elapsed, resends, timeouts, messages):
+        self.commands = commands
+        self.elapsed = elapsed  # s
+        self.resends = resends  # commands sent again after a timeout
+        self.timeouts = timeouts
+        self.messages = messages  # firmware lines that were not answers
+
+    def rate(self):
+        return self.commands / self.elapsed if self.elapsed > 0 else 0.0
+
+    def report(self):
+        return ('commands: %d\n' % self.commands +
+                'time: %.2f s (%.1f commands/s)\n' % (self.elapsed, self.rate()) +
+                'timeouts: %d (%d commands resent)\n' % (self.timeouts, self.resends))
+
+
+def consoleProgress(done, total, elapsed, eta):
+    try:
+        import FreeCAD
+        write = FreeCAD.Console.PrintMessage
+
+    except ImportError:
+        write = lambda msg: print(msg.rstrip('\n'))
+
+    write('sent %d/%d (%.1f%%)  elapsed %d s  ETA %d s\n'
+          % (done, total, 100.0*done/max(total, 1), elapsed, eta))
+
+
+class NiCrSender:
+    def __init__(self, port, window=1, buffer_size=64, timeout=5.0, retries=3,
+                 progress=None, progress_interval=1.0, eol='', sequenced=False):
+        self.port = port
+        self.sequenced = sequenced
+        self.window = max(1, window)
+        self.eol = eol  # appended to every instruction
+        self.buffer_size = buffer_size  # bytes of the firmware serial buffer
+        self.timeout = timeout  # s without any answer
+        self.retries = retries
+        self.progress = progress  # progress(done, total, elapsed, eta)
+        self.progress_interval = progress_interval  # s between progress calls
+
+    def _fits(self, in_flight, text):
+        if not in_flight:
+            return True
+
+        used = sum(len(line) for seq, line, command in in_flight)
+        return len(in_flight) < self.window and used + len(text) <= self.buffer_size
+
+    def _line(self, seq, command):
+        if self.sequenced:
+            return 'N' + str(seq) + ' ' + command.text + self.eol
+
+        return command.text + self.eol
+
+    def _completes(self, line, front):
+        # True if line is the answer that completes the front instruction
+        seq, text, command = front
+        if self.sequenced:
+            return line == ACK + ' ' + str(seq)
+
+        if command.kind in NO_ACK:
+            return line == command.kind
+
+        return line == ACK
+
+    def send(self, commands, times=None):
+        # streams commands (list of NiCrCommand) and returns SendStats.
+        # times -> estimated time of every command for the ETA (commandTimes)
+        total = len(commands)
+        weights = numpy.cumsum(times if times is not None else numpy.ones(total))
+        in_flight = collections.deque()
+        sent = done = resends = timeouts = messages = attempts = 0
+        t0 = last_progress = time.time()
+        while done < total:
+            while sent < total and self._fits(in_flight, self._line(sent, commands[sent])):
+                text = self._line(sent, commands[sent])
+                self.port.write(text)
+                in_flight.append((sent, text, commands[sent]))
+                sent += 1
+
+            line = self.port.readline(self.timeout)
+            if line is None:
+                timeouts += 1
+                attempts += 1
+                command = in_flight[0][2]
+                if not(self.sequenced) or attempts > self.retries:
+                    raise NiCrSenderError('no answer to line ' + str(command.line) +
+                                          ' (' + command.text + ')')
+
+                # the firmware only runs the sequence numbers it has not seen
+                for seq, text, command in in_flight:
+                    self.port.write(text)
+
+                resends += len(in_flight)
+                continue
+
+            line = line.strip()
+            if in_flight and self._completes(line, in_flight[0]):
+                in_flight.popleft()
+
+            else:
+                # other output, or answers to repeated sequence numbers
+                if line:
+                    messages += 1
+
+                continue
+
+            done += 1
+            attempts = 0
+            now = time.time()
+            if self.progress and (now - last_progress >= self.progress_interval or
+                                  done == total):
+                elapsed = now - t0
+                eta = elapsed*(weights[-1] - weights[done - 1])/weights[done - 1]
+                self.progress(done, total, elapsed, eta)
+                last_progress = now
+
+        return SendStats(total, time.time() - t0, resends, timeouts, messages)
+
+
+def sendNiCrFile(file_name, port_name, baudrate=115200, window=1, buffer_size=64,
+                 timeout=5.0, retries=3, progress=consoleProgress, eol='',
+                 sequenced=False):
+    commands = programCommands(file_name)
+    port = openPort(port_name, baudrate)
+    try:
+        sender = NiCrSender(port, window, buffer_size, timeout, retries, progress,
+                            eol=eol, sequenced=sequenced)
+        return sender.send(commands, commandTimes(commands))
+
+    finally:
+        port.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Send a NiCr program to the machine')
+    parser.add_argument('program', help='.nicr or .nicrb file')
+    parser.add_argument('port', help='serial port (/dev/ttyUSB0, COM3...)')
+    parser.add_argument('--baudrate', type=int, default=115200)
+    parser.add_argument('--window', type=int, default=1,
+                        help='instructions in flight (1 for NiCrFW.ino)')
+    parser.add_argument('--buffer-size', type=int, default=64)
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--line-break', action='store_true',
+                        help='end every instruction with a line break')
+    parser.add_argument('--sequenced', action='store_true',
+                        help='N<seq> instructions, resent after a timeout')
+    args = parser.parse_args()
+    stats = sendNiCrFile(args.program, args.port, args.baudrate, args.window,
+                         args.buffer_size, args.timeout, args.retries,
+                         eol='\n' if args.line_break else '',
+                         sequenced=args.sequenced)
+    print(stats.report().rstrip('\n'))
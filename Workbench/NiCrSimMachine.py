@@ -24,6 +24,8 @@
 
 import FreeCAD
 import Part
+import NiCrCore
+import NiCrKinematics
 
 class NiCrMachine:
     def __init__( self, obj ):
@@ -65,6 +67,16 @@ class NiCrMachine:
                         'Animation',
                         'Time between animation frames (0.0 = max speed)').AnimationDelay = 0.0
 
+        obj.addProperty('App::PropertyFloat',
+                        'TargetFPS',
+                        'Animation',
+                        'Frames drawn per second, skipping path points (0.0 = draw every point)').TargetFPS = 0.0
+
+        obj.addProperty('App::PropertyInteger',
+                        'TrailChunkSize',
+                        'Animation',
+                        'Wire segments per trajectory object').TrailChunkSize = 200
+
         obj.Proxy = self
         self.addMachineToDocument( obj.FrameDiameter, obj.XLength, obj.YLength, obj.ZLength, created=False )
 
@@ -226,21 +238,20 @@ def dbm(ms):
 
 
 # Machine animation ----------------------------------------------------------
+def framePlanes(machine):
+    # Z of the machine workplanes (side A, side B) the wire is projected to
+    Z0 = machine.FrameDiameter*1.1*0
+    Z1 = machine.ZLength + Z0 - machine.FrameDiameter*0.2
+    return Z0, Z1
+
+
 def runSimulation(complete_raw_path):
     # FreeCAD.ActiveDocument.WirePath.ViewObject.Visibility = False
-    projected_trajectory_A = []
-    projected_trajectory_B = []
-    Z0 = FreeCAD.ActiveDocument.NiCrMachine.FrameDiameter*1.1*0
-    ZL = FreeCAD.ActiveDocument.NiCrMachine.ZLength
-    Z1 = ZL + Z0 - FreeCAD.ActiveDocument.NiCrMachine.FrameDiameter*0.2
-    for i in range(len(complete_raw_path[0])):
-        PA = complete_raw_path[0][i]
-        PB = complete_raw_path[1][i]
-        proj_A, proj_B = projectEdgeToTrajectory(PA, PB, Z0, Z1)
-        projected_trajectory_A.append(proj_A)
-        projected_trajectory_B.append(proj_B)
-
-    machine_path = (projected_trajectory_A, projected_trajectory_B)
+    Z0, Z1 = framePlanes(FreeCAD.ActiveDocument.NiCrMachine)
+    projected_A, projected_B = NiCrCore.projectRouteToPlanes(complete_raw_path[0],
+                                                             complete_raw_path[1],
+                                                             Z0, Z1)
+    machine_path = (projected_A.tolist(), projected_B.tolist())
 
     # simulate machine path
     import time
@@ -272,61 +283,65 @@ def runSimulation(complete_raw_path):
     # ofsets
     xoff = FreeCAD.ActiveDocument.NiCrMachine.FrameDiameter*1.5*0
     yoff = FreeCAD.ActiveDocument.NiCrMachine.FrameDiameter*1.8*0
-    wire_t_list = []
     animation_delay = FreeCAD.ActiveDocument.NiCrMachine.AnimationDelay
-    wire_trajectory = FreeCAD.ActiveDocument.addObject('Part::Feature','wire_tr')
-    wire_tr_folder.addObject(wire_trajectory)
-    # n iterator (for wire color)
-    n = 0
+    # trajectory objects hold at most chunk_size wire segments, so each frame
+    # only rebuilds the compound of the last chunk
+    chunk_size = max(1, getattr(FreeCAD.ActiveDocument.NiCrMachine, 'TrailChunkSize', 200))
+    target_fps = getattr(FreeCAD.ActiveDocument.NiCrMachine, 'TargetFPS', 0.0)
     # visualization color
     vcolor = FreeCAD.ActiveDocument.WirePath.TrajectoryColor
-    # determine the first value for the wire color
-    if vcolor == 'Speed':
-        mxspeed = FreeCAD.ActiveDocument.WirePath.MaxCutSpeed
-        cpspeed = complete_raw_path[2][n][1]
-        wire_color = WireColor(cpspeed, mxspeed, 'Speed')
+    mxspeed = FreeCAD.ActiveDocument.WirePath.MaxCutSpeed
+    mxtemp = FreeCAD.ActiveDocument.WirePath.MaxWireTemp
+    commands = sorted(complete_raw_path[2], key=lambda cmd: cmd[0])
+
+    def commandColor(n):
+        # wire color of the route command n (the first one before any command)
+        cmd = commands[max(n, 0)]
+        if vcolor == 'Temperature':
+            return WireColor(cmd[2], mxtemp, 'Temperature')
 
-    if vcolor == 'Temperature':
-        mxtemp = FreeCAD.ActiveDocument.WirePath.MaxWireTemp
-        cptemp = complete_raw_path[2][n][1]
-        wire_color = WireColor(cptemp, mxtemp, 'Temperature')
+        return WireColor(cmd[1], mxspeed, 'Speed')
 
+    # n iterator (current command, for wire color)
+    n = -1
+    wire_trajectory = None
+    wire_t_list = []
+    last_frame = 0.0
     # animation loop
     for i in range(len(machine_path[0])):
-        pa = machine_path[0][i]
-        pb = machine_path[1][i]
-        # draw wire
+        pa = FreeCAD.Vector(machine_path[0][i])
+        pb = FreeCAD.Vector(machine_path[1][i])
         w = Part.makeLine(pa, pb)
-        wire.Shape = w
-        wire.ViewObject.LineColor = wire_color
-        if i < complete_raw_path[2][n][0]:
-            # draw wire trajectory
-            wire_t_list.append(w)
-            wire_trajectory.Shape = Part.makeCompound(wire_t_list)
-            wire_trajectory.ViewObject.LineColor = wire_color
-
-        else:
+        # the command placed at point i applies from this point on
+        new_command = False
+        while n + 1 < len(commands) and commands[n + 1][0] <= i:
             n += 1
+            new_command = True
+
+        if wire_trajectory is None or new_command or len(wire_t_list) >= chunk_size:
+            if wire_trajectory is not None:
+                # flush the finished chunk
+                wire_trajectory.Shape = Part.makeCompound(wire_t_list)
+
+            wire_color = commandColor(n)
             # create new wire trajectory object
             wire_trajectory = FreeCAD.ActiveDocument.addObject('Part::Feature', 'wire_tr')
             wire_tr_folder.addObject(wire_trajectory)
-            # reset compound list
-            wire_t_list = []
-            wire_t_list.append(w)
-            wire_trajectory.Shape = Part.makeCompound(wire_t_list)
-            # establish wire color
-            if vcolor == 'Speed':
-                mxspeed = FreeCAD.ActiveDocument.WirePath.MaxCutSpeed
-                cpspeed = complete_raw_path[2][n][1]
-                wire_color = WireColor(cpspeed, mxspeed, 'Speed')
-
-            if vcolor == 'Temperature':
-                mxtemp = FreeCAD.ActiveDocument.WirePath.MaxWireTemp
-                cptemp = complete_raw_path[2][n][1]
-                wire_color = WireColor(cptemp, mxtemp, 'Temperature')
-
-            # assign wire color
             wire_trajectory.ViewObject.LineColor = wire_color
+            wire_t_list = []
+
+        wire_t_list.append(w)
+        # frame skip: with a target fps only the frames due are drawn
+        now = time.time()
+        if (target_fps > 0 and i < len(machine_path[0]) - 1 and
+                now - last_frame < 1.0/target_fps):
+            continue
+
+        last_frame = now
+        # draw wire and wire trajectory
+        wire.Shape = w
+        wire.ViewObject.LineColor = wire_color
+        wire_trajectory.Shape = Part.makeCompound(wire_t_list)
 
         # move machine ---------------------------------------------------
         # side A
@@ -355,15 +370,22 @@ def runSimulation(complete_raw_path):
         time.sleep(animation_delay)
 
 
-def projectEdgeToTrajectory(PA, PB, Z0, Z1):
-    # aux function of runSimulation
-    # projects shape points to machine workplanes
-    pa = FreeCAD.Vector(PA[0], PA[1], PA[2])
-    pb = FreeCAD.Vector(PB[0], PB[1], PB[2])
-    line_vector = FreeCAD.Vector(PA[0]-PB[0], PA[1]-PB[1], PA[2]-PB[2]).normalize()
-    projected_pa = pa + line_vector*(pa[2] - Z0)
-    projected_pb = pb - line_vector*(Z1 - pb[2])
-    return projected_pa, projected_pb
+def estimateCutTime(complete_raw_path):
+    # prints the firmware step and time estimate of the program that would be
+    # exported from complete_raw_path (see NiCrKinematics)
+    zero_point = FreeCAD.ActiveDocument.NiCrMachine.VirtualMachineZero
+    result = NiCrKinematics.simulateRoute(complete_raw_path, zero_point,
+                                          planes=exportPlanes())
+    FreeCAD.Console.PrintMessage(result.report())
+    return result
+
+
+def exportPlanes():
+    # frame planes of the exported coordinates, None for part coordinates
+    if getattr(FreeCAD.ActiveDocument.WirePath, 'ExportFramePlanes', False):
+        return framePlanes(FreeCAD.ActiveDocument.NiCrMachine)
+
+    return None
 
 
 def WireColor(value, crange, ctype):